@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""Run CNVkit's fix and segment steps for a whole cohort of samples.
+
+Equivalent to running, for each sample's .targetcoverage.cnn file::
+
+    cnvkit.py fix <sample>.targetcoverage.cnn <sample>.antitargetcoverage.cnn \\
+        <reference> -o <output dir>/<sample>.cnr
+    cnvkit.py segment --drop-low <output dir>/<sample>.cnr \\
+        -o <output dir>/<sample>.cns
+
+but in one long-lived process (or a pool of them): cnvlib is imported and the
+reference is read once, not once per sample and step. As with make, outputs
+that are newer than their inputs are kept as they are.
+"""
+from __future__ import absolute_import, division, print_function
+import argparse
+import os
+import sys
+
+from cnvlib import fix, read, segmentation
+from skgenome import tabio
+
+from batch_jobs import imap_jobs, is_current
+
+
+def sample_paths(target_fname, output_dir):
+    """Antitarget input and .cnr, .cns output paths for a sample."""
+    base = os.path.basename(target_fname)
+    assert base.endswith(".targetcoverage.cnn"), base
+    sample = base[:-len(".targetcoverage.cnn")]
+    antitarget_fname = os.path.join(os.path.dirname(target_fname),
+                                    sample + ".antitargetcoverage.cnn")
+    cnr_fname = os.path.join(output_dir, sample + ".cnr")
+    return antitarget_fname, cnr_fname, cnr_fname[:-4] + ".cns"
+
+
+def is_done(target_fname, output_dir, reference_fname):
+    """True if the sample's .cnr and .cns are both up to date."""
+    antitarget_fname, cnr_fname, cns_fname = sample_paths(target_fname,
+                                                          output_dir)
+    return (is_current(cnr_fname, [target_fname, antitarget_fname,
+                                   reference_fname])
+            and is_current(cns_fname, [cnr_fname]))
+
+
+def fix_and_segment(target_fname, state):
+    """Write the sample's .cnr and .cns, unless already up to date.
+
+    `state` is the reference (CopyNumArray) and the options shared by all
+    samples.
+
+    Returns the names of the files written.
+    """
+    reference, (output_dir, reference_fname, drop_low, drop_outliers) = state
+    antitarget_fname, cnr_fname, cns_fname = sample_paths(target_fname,
+                                                          output_dir)
+    written = []
+    if is_current(cnr_fname, [target_fname, antitarget_fname,
+                              reference_fname]):
+        cnarr = None
+    else:
+        cnarr = fix.do_fix(read(target_fname), read(antitarget_fname),
+                           reference)
+        tabio.write(cnarr, cnr_fname)
+        written.append(cnr_fname)
+    if not is_current(cns_fname, [cnr_fname]):
+        if cnarr is None:
+            cnarr = read(cnr_fname)
+        segments = segmentation.do_segmentation(cnarr, 'cbs',
+                                                skip_low=drop_low,
+                                                skip_outliers=drop_outliers)
+        tabio.write(segments, cns_fname)
+        written.append(cns_fname)
+    return written
+
+
+if __name__ == '__main__':
+    AP = argparse.ArgumentParser(description=__doc__)
+    AP.add_argument('target_fnames', nargs='+',
+                    help="""Samples' *.targetcoverage.cnn files. The
+                    *.antitargetcoverage.cnn files are taken from the same
+                    directories.""")
+    AP.add_argument('-r', '--reference', required=True,
+                    help="Copy number reference (.cnn) for all samples.")
+    AP.add_argument('-d', '--output-dir', default='build',
+                    help="Output directory. [Default: %(default)s]")
+    AP.add_argument('--drop-low', action='store_true',
+                    help="""Drop very-low-coverage bins before segmentation,
+                    as in 'cnvkit.py segment --drop-low'.""")
+    AP.add_argument('--drop-outliers', type=float, default=10,
+                    help="""Drop outlier bins before segmentation, as in
+                    'cnvkit.py segment --drop-outliers' (0 to keep all).
+                    [Default: %(default)s]""")
+    AP.add_argument('-p', '--processes', type=int, default=1,
+                    help="""Number of worker processes (0 for all CPUs)
+                    [%(default)s].""")
+    args = AP.parse_args()
+
+    options = (args.output_dir, args.reference, args.drop_low,
+               args.drop_outliers)
+    todo = [fname for fname in args.target_fnames
+            if not is_done(fname, args.output_dir, args.reference)]
+    print("Processing", len(todo), "of", len(args.target_fnames), "samples",
+          file=sys.stderr)
+    reference = read(args.reference) if todo else None
+    for fnames in imap_jobs(fix_and_segment, todo, args.processes,
+                            shared=(reference, options)):
+        for fname in fnames:
+            print("Wrote", fname, file=sys.stderr)
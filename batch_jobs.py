@@ -0,0 +1,63 @@
+"""Run a script's jobs in this process or in a pool of worker processes.
+
+Jobs that need large read-only data (a reference, a gene index) get it as a
+shared state, which is sent to each worker process once, when the worker
+starts, rather than with every job. Also checks whether an output file is up
+to date, as make would, so batch scripts can skip finished work.
+
+Used by batch_fix_segment.py, plot_cnv_bias.py, compare/contra_batch.py,
+compare/load_diffs.py, rna/collate_by_gene.py and rna/tcga2cns.py; scripts in
+subdirectories add this directory to sys.path to import it.
+"""
+from __future__ import absolute_import, division, print_function
+
+import multiprocessing
+import os
+
+# Per-process job function and state of the pool's workers
+_FUNC = None
+_STATE = None
+
+
+def _init_worker(func, shared, setup):
+    global _FUNC, _STATE
+    _FUNC = func
+    _STATE = setup(shared) if setup is not None else shared
+
+
+def _run_job(job):
+    return _FUNC(job, _STATE)
+
+
+def imap_jobs(func, jobs, processes=1, shared=None, setup=None):
+    """Yield ``func(job, state)`` for each of `jobs`, in order.
+
+    The `state` is `shared`, or if `setup` is given, ``setup(shared)``, made
+    once per process. With `processes` other than 1 (0 or None for one per
+    CPU), the jobs are run in a pool of that many worker processes; otherwise,
+    or with fewer than 2 jobs, in this process. `func` and `setup` must be
+    module-level functions, so the workers can find them.
+
+    The pool is shut down when the generator is exhausted or closed.
+    """
+    if processes == 1 or (hasattr(jobs, '__len__') and len(jobs) < 2):
+        state = setup(shared) if setup is not None else shared
+        for job in jobs:
+            yield func(job, state)
+        return
+    pool = multiprocessing.Pool(processes or None, _init_worker,
+                                (func, shared, setup))
+    try:
+        for result in pool.imap(_run_job, jobs):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def is_current(output, inputs):
+    """True if `output` exists and is newer than all of `inputs`."""
+    if not os.path.isfile(output):
+        return False
+    mtime = os.path.getmtime(output)
+    return all(os.path.getmtime(fname) < mtime for fname in inputs)
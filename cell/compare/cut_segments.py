@@ -3,23 +3,32 @@
 """Match up and aggregate gene coverages between 2 sets of samples."""
 from __future__ import division, print_function
 
+import os
 import sys
 
 import pandas
-import numpy as np
 
 import cnvlib
 from cnvlib import ngfrills
 
+from pair_segments import is_skipped_chromosome, weighted_overlap_cn
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, os.pardir))
+from pair_tables import write_table
+
 
 # --- by aCGH segment ---
 MIN_ACGH_PROBES = 10
 
 def read_paired_genes(cbs1, cbs2, interval):
-    """Get the segment CN values for each targeted region.
+    """Get the segment CN values for each sizable aCGH segment.
 
-    For genes with 2 or more segments, take the longest segment (or [weighted]
-    average).
+    For aCGH segments overlapping 2 or more CNVkit segments, take the average
+    of the CNVkit segments weighted by their trimmed overlap length.
+
+    Returns a pandas.DataFrame with columns:
+        chromosome, start, end, label, value1, value2
     """
     segments1 = cnvlib.read(cbs1)
     segments2 = cnvlib.read(cbs2)
@@ -33,66 +42,63 @@ def read_paired_genes(cbs1, cbs2, interval):
     segments1.sort()
     segments2.sort()
 
-    for s1_chrom, s1_start, s1_end, s1_name, s1_value, s1_probes in segments1:
-        if s1_probes < MIN_ACGH_PROBES or is_skipped_chromosome(s1_chrom):
-            continue
-        s1_name = "{}:{}-{}".format(s1_chrom, s1_start, s1_end)
-        seglike2 = segments2.in_range(s1_chrom, s1_start, s1_end, trim=True)
-        if len(seglike2) == 0:
-            print("Skipping", s1_name, "-- covers no CNVkit segments")
-            continue
-        s2_value = segment_cn(seglike2)
-        yield (s1_chrom, s1_value, s2_value, s1_start, s1_end, s1_name)
-
-
-def is_skipped_chromosome(chrom):
-    return (chrom in ('X', 'Y', 'chrX', 'chrY') or
-            chrom.startswith(('chrUn_', 'Un_')) or
-            chrom.endswith('_random'))
-
-
-def segment_cn(segset):
-    """Get or estimate the segment's copy number.
-
-    If the segment set only contains one row (i.e. segment), just return that
-    value. Otherwise, return the weighted mean of the segment log2 values.
-    """
-    if len(segset) == 0:
-        raise ValueError("WTF: %s" % segset)
-    elif len(segset) == 1:
-        return segset.coverage[0]
-    else:
-        return np.average(segset.coverage, weights=(segset.end - segset.start))
-
-
-def pairs_as_dframe(pairs):
-    """Get overlapping regions of two paired segment/gene sets.
-
-    Returns a pandas.DataFrame with columns: chrom, start, end, cns1, cns2
-    """
-    col_chrom, col_val1, col_val2, col_start, col_end, col_label = zip(*pairs)
-    return pandas.DataFrame.from_items([
-        ("chromosome", np.asarray(col_chrom)),
-        ("start", np.asarray(col_start)),
-        ("end", np.asarray(col_end)),
-        ("label", np.asarray(col_label)),
-        ("value1", np.asarray(col_val1)),
-        ("value2", np.asarray(col_val2))])
+    acgh = segments1.data
+    # Segments with no probe count (NaN) are kept
+    keep = (~(acgh.probes < MIN_ACGH_PROBES) &
+            ~acgh.chromosome.apply(is_skipped_chromosome))
+    acgh = acgh[keep.values]
+    table = pandas.DataFrame({
+        "chromosome": acgh.chromosome.values,
+        "start": acgh.start.values,
+        "end": acgh.end.values,
+        "label": (acgh.chromosome + ":" + acgh.start.astype(str) + "-" +
+                  acgh.end.astype(str)).values,
+        "value1": acgh.log2.values,
+    }, columns=["chromosome", "start", "end", "label", "value1"])
+    values2, counts2 = weighted_overlap_cn(segments2,
+                                           table.chromosome.values,
+                                           table.start.values,
+                                           table.end.values)
+    for name in table.label.values[counts2 == 0]:
+        print("Skipping", name, "-- covers no CNVkit segments")
+    table["value2"] = values2
+    return table[counts2 > 0].reset_index(drop=True)
+
+
+def pair_filenames(filenames):
+    """Group positional segment filenames into (aCGH, CNVkit) pairs."""
+    if len(filenames) % 2:
+        raise ValueError("Expected pairs of segment files, got %d files"
+                         % len(filenames))
+    return list(zip(filenames[::2], filenames[1::2]))
 
 
 def main(args):
     """Make and emit the table."""
-    chrom_coords = read_paired_genes(args.asegment, args.bsegment,
-                                     args.interval)
-    table = pairs_as_dframe(list(chrom_coords))
-    table.to_csv(args.output or sys.stdout, index=False)
+    pairs = pair_filenames(args.segments)
+    if len(pairs) == 1:
+        table = read_paired_genes(pairs[0][0], pairs[0][1], args.interval)
+    else:
+        # Stack all pairs into one table, labeled by the CNVkit sample
+        tables = []
+        for cbs1, cbs2 in pairs:
+            table = read_paired_genes(cbs1, cbs2, args.interval)
+            table.insert(0, "sample",
+                         os.path.splitext(os.path.basename(cbs2))[0])
+            tables.append(table)
+        table = pandas.concat(tables, ignore_index=True)
+    write_table(table, args.output)
 
 
 if __name__ == '__main__':
     import argparse
     AP = argparse.ArgumentParser(description=__doc__)
-    AP.add_argument("asegment", help="Segmentation calls")
-    AP.add_argument("bsegment", help="Segmentation calls")
+    AP.add_argument("segments", nargs='+',
+                    help="""Segmentation calls, as one or more pairs of aCGH
+                    and CNVkit .cns files: A1 B1 [A2 B2 ...]. With more than
+                    one pair, the output table is prefixed with a 'sample'
+                    column.""")
     AP.add_argument("-i", "--interval", help="Target intervals list")
-    AP.add_argument("-o", "--output", help="Output PDF file name")
+    AP.add_argument("-o", "--output",
+                    help="Output CSV (or binary .npy) file name")
     main(AP.parse_args())
@@ -3,6 +3,7 @@
 """Match up and aggregate gene log2 ratios between 2 sets of samples."""
 from __future__ import division, print_function
 
+import os
 import sys
 
 import pandas
@@ -11,6 +12,10 @@ import numpy as np
 import cnvlib
 from cnvlib import ngfrills
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, os.pardir))
+from pair_tables import write_table
+
 
 # --- by targeted interval ---
 
@@ -38,23 +43,100 @@ def read_paired_genes(cbs1, cbs2, interval):
 
     genes = list(interval2genes(interval))
     print("#Genes tiled:", len(genes), file=sys.stderr)
-
-    has_chr = segments1.chromosome[0].startswith('chr')
-    for chrom, start, end, name in genes:
-    # for chrom, start, end, name in interval2genes(interval):
-        if is_skipped_chromosome(chrom):
-            continue
-        if not has_chr:
-            # Remove the 'chr' prefix from target gene chromosome name
-            chrom = chrom[3:]
-        sel1 = segments1.in_range(chrom, start, end, mode='trim')
-        sel2 = segments2.in_range(chrom, start, end, mode='trim')
-        if len(sel1) == 0 or len(sel2) == 0:
-            print("Skipping", name, "-- not covered by a segment")
+    use_chr = segments1.chromosome.iat[0].startswith('chr')
+    genes = normalize_gene_chroms(genes, use_chr)
+
+    (values1, counts1), (values2, counts2) = [
+        weighted_overlap_cn(segs, genes.chromosome.values,
+                            genes.start.values, genes.end.values)
+        for segs in (segments1, segments2)]
+    covered = (counts1 > 0) & (counts2 > 0)
+    for name in genes.label.values[~covered]:
+        print("Skipping", name, "-- not covered by a segment")
+    table = genes[covered].reset_index(drop=True)
+    table["value1"] = values1[covered]
+    table["value2"] = values2[covered]
+    return table
+
+
+def normalize_gene_chroms(genes, has_chr):
+    """Drop skipped chromosomes and match the segments' chromosome naming.
+
+    Returns a pandas.DataFrame with columns: chromosome, start, end, label
+    """
+    table = pandas.DataFrame.from_records(
+        [gene for gene in genes if not is_skipped_chromosome(gene[0])],
+        columns=["chromosome", "start", "end", "label"])
+    if not has_chr:
+        # Remove the 'chr' prefix from target gene chromosome names
+        table["chromosome"] = table.chromosome.str.replace("^chr", "",
+                                                           regex=True)
+    return table
+
+
+def weighted_overlap_cn(segments, chroms, starts, ends):
+    """Length-weighted mean log2 of the segments overlapping each region.
+
+    Matches `segment_cn` applied to ``segments.in_range(chrom, start, end,
+    mode='trim')`` for each region, but joins all regions against the sorted
+    segments of each chromosome at once. The weighted sums come from prefix
+    sums of ``log2 * length``, corrected for the trimmed first and last
+    overlapping segment.
+
+    Returns
+    -------
+    tuple
+        (values, counts): the weighted mean log2 for each region (NaN if not
+        covered), and the number of segments overlapping each region.
+    """
+    values = np.empty(len(chroms), dtype=float)
+    values.fill(np.nan)
+    counts = np.zeros(len(chroms), dtype=int)
+    seg_chroms = segments.chromosome.values
+    for chrom in pandas.unique(chroms):
+        idx = np.flatnonzero(chroms == chrom)
+        seg_mask = (seg_chroms == chrom)
+        if not seg_mask.any():
             continue
-        val1 = segment_cn(sel1)
-        val2 = segment_cn(sel2)
-        yield (chrom, val1, val2, start, end, name)
+        values[idx], counts[idx] = _chrom_weighted_cn(
+            segments.start.values[seg_mask], segments.end.values[seg_mask],
+            segments.log2.values[seg_mask], starts[idx], ends[idx])
+    return values, counts
+
+
+def _chrom_weighted_cn(seg_starts, seg_ends, seg_log2, starts, ends):
+    """Weighted overlap means for regions on one chromosome."""
+    # Same slicing rule as in_range on non-nested regions
+    lo = np.searchsorted(seg_ends, starts, "right")
+    hi = np.searchsorted(seg_starts, ends, "left")
+    counts = np.maximum(hi - lo, 0)
+    values = np.empty(len(starts), dtype=float)
+    values.fill(np.nan)
+    single = (counts == 1)
+    values[single] = seg_log2[lo[single]]
+    multi = np.flatnonzero(counts > 1)
+    if len(multi):
+        lengths = (seg_ends - seg_starts).astype(float)
+        isnull = np.isnan(seg_log2)
+        cum_w = np.concatenate(([0.], np.cumsum(lengths)))
+        cum_wx = np.concatenate(
+            ([0.], np.cumsum(np.where(isnull, 0., seg_log2 * lengths))))
+        cum_null = np.concatenate(([0], np.cumsum(isnull)))
+        m_lo, m_hi = lo[multi], hi[multi]
+        m_start, m_end = starts[multi], ends[multi]
+        total_w = cum_w[m_hi] - cum_w[m_lo]
+        total_wx = cum_wx[m_hi] - cum_wx[m_lo]
+        # Trim the first and last overlapping segments to the region
+        for edge in (m_lo, m_hi - 1):
+            trimmed = (np.minimum(seg_ends[edge], m_end) -
+                       np.maximum(seg_starts[edge], m_start))
+            excess = lengths[edge] - trimmed
+            total_w -= excess
+            total_wx -= np.where(isnull[edge], 0., seg_log2[edge] * excess)
+        values[multi] = total_wx / total_w
+        # As with np.average, any NaN segment value makes the result NaN
+        values[multi[cum_null[m_hi] > cum_null[m_lo]]] = np.nan
+    return values, counts
 
 
 def segment_cn(segset):
@@ -107,27 +189,10 @@ def interval2genes(interval, skip=('CGH', '-')):
                     file=sys.stderr)
 
 
-def pairs_as_dframe(pairs):
-    """Get overlapping regions of two paired segment/gene sets.
-
-    Returns a pandas.DataFrame with columns: chrom, start, end, cns1, cns2
-    """
-    col_chrom, col_val1, col_val2, col_start, col_end, col_label = zip(*pairs)
-    return pandas.DataFrame.from_items([
-        ("chromosome", np.asarray(col_chrom)),
-        ("start", np.asarray(col_start)),
-        ("end", np.asarray(col_end)),
-        ("label", np.asarray(col_label)),
-        ("value1", np.asarray(col_val1)),
-        ("value2", np.asarray(col_val2))])
-
-
 def main(args):
     """Make and emit the table."""
-    chrom_coords = read_paired_genes(args.asegment, args.bsegment,
-                                     args.interval)
-    table = pairs_as_dframe(list(chrom_coords))
-    table.to_csv(args.output or sys.stdout, index=False)
+    table = read_paired_genes(args.asegment, args.bsegment, args.interval)
+    write_table(table, args.output)
 
 
 if __name__ == '__main__':
@@ -136,5 +201,6 @@ if __name__ == '__main__':
     AP.add_argument("asegment", help="Segmentation calls")
     AP.add_argument("bsegment", help="Segmentation calls")
     AP.add_argument("-i", "--interval", help="Target intervals list")
-    AP.add_argument("-o", "--output", help="Output PDF file name")
+    AP.add_argument("-o", "--output",
+                    help="Output CSV (or binary .npy) file name")
     main(AP.parse_args())
@@ -4,14 +4,19 @@
 from __future__ import division, print_function
 
 import math
+import os
 import sys
 
-# import numpy as np
+import numpy
 import pandas
 import seaborn
 from matplotlib import pyplot
 from scipy import stats
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, os.pardir))
+import density2d
+
 seaborn.set(font='Sans', style='darkgrid')
 # -- segment-wise approach --
 
@@ -33,9 +38,16 @@ def color_alpha(alpha, core_color=[0.298, 0.447, 0.69]):
     return tuple(core_color + [alpha])
 
 
+def read_table(fname):
+    """Load a paired-segments table from CSV or a binary .npy record array."""
+    if fname.endswith(".npy"):
+        return pandas.DataFrame(numpy.load(fname, mmap_mode='r'))
+    return pandas.read_csv(fname)
+
+
 def main(args):
     """."""
-    table = pandas.read_csv(args.table)
+    table = read_table(args.table)
     xvals = table['value1']
     yvals = table['value2']
     print("Sizeable gains/losses:")
@@ -54,34 +66,49 @@ def main(args):
     xymax = max(max(xvals), max(yvals)) + 0.2
     xy_limits = (xymin, xymax)
 
-    grid = seaborn.jointplot('value1', 'value2', data=table,
-                             kind='scatter',
-                             space=.03,
-                             xlim=xy_limits,
-                             ylim=xy_limits,
-                             stat_func=my_stats,
-                             annot_kws=dict(
-                                 template="Pearson r = {val:.3f}\nN = {p}",
-                                 loc='upper left',
-                             ),
-                             joint_kws=dict(
-                                     s=50,
-                                     color="#4C72B0",
-                                     alpha=.2,
-                             ),
-                             marginal_kws=dict(
-                                 bins=int(math.sqrt(len(xvals))),
-                                 hist_kws=dict(
-                                     # range=(xymin, xymax),
-                                     histtype='stepfilled',
-                                     alpha=None,
-                                     color=color_alpha(0.4),
-                                     edgecolor=color_alpha(1.0),
-                                     linewidth=1,
+    if args.density:
+        # Pre-binned counts; drawing cost doesn't depend on the table size
+        nbins = int(math.sqrt(len(xvals)))
+        dgrid = density2d.DensityGrid.from_points(xvals, yvals, nbins,
+                                                  xy_limits, xy_limits)
+        _fig, ax_joint, _ax_x, _ax_y = density2d.plot_density(
+            dgrid, space=.03, cmap="Blues",
+            hist_kws=dict(alpha=None,
+                          color=color_alpha(0.4),
+                          edgecolor=color_alpha(1.0)))
+        r_coef, n = my_stats(xvals, yvals)
+        ax_joint.text(.03, .97, "Pearson r = {:.3f}\nN = {}".format(r_coef, n),
+                      transform=ax_joint.transAxes, verticalalignment='top')
+    else:
+        grid = seaborn.jointplot('value1', 'value2', data=table,
+                                 kind='scatter',
+                                 space=.03,
+                                 xlim=xy_limits,
+                                 ylim=xy_limits,
+                                 stat_func=my_stats,
+                                 annot_kws=dict(
+                                     template="Pearson r = {val:.3f}\nN = {p}",
+                                     loc='upper left',
+                                 ),
+                                 joint_kws=dict(
+                                         s=50,
+                                         color="#4C72B0",
+                                         alpha=.2,
+                                 ),
+                                 marginal_kws=dict(
+                                     bins=int(math.sqrt(len(xvals))),
+                                     hist_kws=dict(
+                                         # range=(xymin, xymax),
+                                         histtype='stepfilled',
+                                         alpha=None,
+                                         color=color_alpha(0.4),
+                                         edgecolor=color_alpha(1.0),
+                                         linewidth=1,
+                                     ),
                                  ),
-                             ),
 
-                            )
+                                )
+        ax_joint = grid.ax_joint
 
     # --- muy viejo ---
     # fig = pyplot.figure()
@@ -108,16 +135,16 @@ def main(args):
     # Set axes to be square
 
     # Plot a diagonal line
-    grid.ax_joint.plot(xy_limits, xy_limits, color='white', linestyle='-',
-                       linewidth=1, zorder=-1)
+    ax_joint.plot(xy_limits, xy_limits, color='white', linestyle='-',
+                  linewidth=1, zorder=-1)
 
     # axes.set_title("Copy number changes after TKI treatment")
     # pyplot.title("Copy ratios assessed by array CGH and CNVkit", zorder=10)
     # axes.legend(legend_plots, legend_labels)
     # TODO - fix legend aesthetics -- one circle each, reasonable size
     # TODO - axis labels as arguments
-    grid.ax_joint.set_xlabel(args.x_label + " copy ratio (log2)")
-    grid.ax_joint.set_ylabel(args.y_label + " copy ratio (log2)")
+    ax_joint.set_xlabel(args.x_label + " copy ratio (log2)")
+    ax_joint.set_ylabel(args.y_label + " copy ratio (log2)")
     # grid.ax_joint.set_xlabel("Lane 1 copy ratio (log2)")
     # grid.ax_joint.set_ylabel("Lane 2 copy ratio (log2)")
 
@@ -131,8 +158,11 @@ def main(args):
 if __name__ == '__main__':
     import argparse
     AP = argparse.ArgumentParser(description=__doc__)
-    AP.add_argument("table", help="Data table (.csv)")
+    AP.add_argument("table", help="Data table (.csv or .npy)")
     AP.add_argument("-o", "--output", help="Output PDF file name")
+    AP.add_argument("-d", "--density", action='store_true',
+                    help="""Draw a binned density image instead of a scatter
+                    of every segment.""")
     AP.add_argument("-x", "--x-label", default="aCGH", help="x-axis label")
     AP.add_argument("-y", "--y-label", default="CNVkit", help="y-axis label")
     main(AP.parse_args())
@@ -4,28 +4,117 @@
 
 This lets us skip recalculating GC and RepeatMasker values from the reference
 genome sequence when creating another CNVkit reference.
-Both CNVkit references must have the same number of rows (corresponding to the
-same positions).
+Values are matched to bins by genomic coordinates (chromosome, start, end), so
+the two references don't need to have the same bins. Annotations can also be
+kept in a persistent cache table (--cache), which accumulates the values from
+every reference it has seen.
+
+Bins that aren't found in either are reported; with --fasta, only those bins'
+values are calculated from the genome sequence (and added to the cache).
 """
+from __future__ import division, print_function
 
 import argparse
+import os
 import sys
 
+import pandas as pd
+
 import cnvlib
+from cnvlib import reference
+
+KEYS = ["chromosome", "start", "end"]
+ANNOTATIONS = ["gc", "rmask"]
+
+
+def read_cache(fname):
+    """Read the annotation cache table, or an empty one if not created yet."""
+    dtypes = {"chromosome": str, "start": int, "end": int, "gc": float,
+              "rmask": float}
+    if fname and os.path.isfile(fname):
+        return pd.read_table(fname, dtype=dtypes)
+    return pd.DataFrame({col: pd.Series(dtype=dtypes[col])
+                         for col in KEYS + ANNOTATIONS},
+                        columns=KEYS + ANNOTATIONS)
+
+
+def add_to_cache(cache, table):
+    """Add the coordinates and annotations of more bins to the cache.
+
+    Newer values replace cached values for the same coordinates.
+    """
+    table = table.loc[table[ANNOTATIONS].notnull().all(axis=1),
+                      KEYS + ANNOTATIONS]
+    return (pd.concat([cache, table], ignore_index=True)
+            .drop_duplicates(KEYS, keep='last')
+            .reset_index(drop=True))
+
+
+def annotate(cnarr, cache):
+    """Fill in gc/rmask from the cache by coordinates, in place.
+
+    Returns a boolean array marking the bins that weren't in the cache.
+    """
+    merged = cnarr.data[KEYS].merge(cache, how='left', on=KEYS)
+    for col in ANNOTATIONS:
+        cnarr[col] = merged[col].values
+    return merged[ANNOTATIONS].isnull().any(axis=1).values
+
+
+def main(args):
+    cache = read_cache(args.cache)
+    for fname in [args.orig] + args.also:
+        cache = add_to_cache(cache, cnvlib.read(fname).data)
+
+    other_arr = cnvlib.read(args.other)
+    missing = annotate(other_arr, cache)
+    print("Found", len(missing) - missing.sum(), "of", len(missing),
+          "bins' GC and RepeatMasker values by coordinates;",
+          missing.sum(), "missing", file=sys.stderr)
+    if missing.any():
+        if args.missing:
+            other_arr.data.loc[missing, KEYS].to_csv(args.missing, sep='\t',
+                                                     header=False, index=False)
+            print("Wrote", args.missing, file=sys.stderr)
+        if not args.fasta:
+            sys.exit("Bins are missing GC/RepeatMasker values; "
+                     "use -f/--fasta to calculate them")
+        # Calculate only the bins that aren't already annotated
+        todo = other_arr[missing]
+        todo["gc"], todo["rmask"] = reference.get_fasta_stats(todo,
+                                                              args.fasta)
+        cache = add_to_cache(cache, todo.data)
+        annotate(other_arr, cache)
+
+    if args.cache:
+        cache.to_csv(args.cache, sep='\t', index=False)
+        print("Updated cache", args.cache, "with", len(cache), "bins",
+              file=sys.stderr)
+
+    other_arr.sort()
+    other_arr.sort_columns()
+    other_arr.write(args.output)
+
 
-AP = argparse.ArgumentParser(description=__doc__)
-AP.add_argument("orig")
-AP.add_argument("other")
-AP.add_argument("-o", "--output", type=argparse.FileType('w'),
-                default=sys.stdout)
-args = AP.parse_args()
-
-orig_arr = cnvlib.read(args.orig)
-other_arr = cnvlib.read(args.other)
-assert len(other_arr) == len(orig_arr)
-
-other_arr["gc"] = orig_arr["gc"]
-other_arr["rmask"] = orig_arr["rmask"]
-other_arr.sort()
-other_arr.sort_columns()
-other_arr.write(args.output)
+if __name__ == '__main__':
+    AP = argparse.ArgumentParser(description=__doc__)
+    AP.add_argument("orig",
+                    help="""Reference (.cnn) with the gc and rmask values to
+                    reuse.""")
+    AP.add_argument("other", help="Reference (.cnn) to annotate.")
+    AP.add_argument("-a", "--also", nargs='+', default=[],
+                    help="""More references with gc/rmask values, to look up
+                    bins that are not in 'orig'.""")
+    AP.add_argument("-c", "--cache",
+                    help="""Annotation cache table (chromosome, start, end,
+                    gc, rmask) to read values from and save all known values
+                    to, for later runs.""")
+    AP.add_argument("-f", "--fasta",
+                    help="""Reference genome, to calculate values for the bins
+                    not found in any reference or the cache.""")
+    AP.add_argument("-m", "--missing",
+                    help="""Write the coordinates of bins without known values
+                    to this BED file.""")
+    AP.add_argument("-o", "--output", type=argparse.FileType('w'),
+                    default=sys.stdout)
+    main(AP.parse_args())
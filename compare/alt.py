@@ -6,6 +6,8 @@ Summarize differences in assay values, and plot vs. the mean of both assays.
 """
 from __future__ import division, print_function
 
+import hashlib
+import os
 import sys
 # from os.path import basename
 
@@ -14,30 +16,133 @@ import pandas
 import seaborn
 from matplotlib import pyplot
 
+from tdigest import TDigest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+import density2d
+
 seaborn.set_style("ticks")
 
 # Interquartile range of segmented log2 values in normal TR samples
 NEUTRAL_RANGE = None
 
 
-def plot_diffs_vs_means(name, diffs, means):
-    grid = seaborn.jointplot(means, diffs, kind='scatter', stat_func=None,
-                             space=0, size=6, ylim=(-2.0, 2.0),
-                             marginal_kws={'bins': 60,
-                                           'hist_kws': {
-                                               'histtype': 'stepfilled',
-                                               'range': (-2, 2),
-                                           }},
-                             joint_kws={'alpha': 0.2})
-    grid.ax_joint.set_xlabel("Mean estimated log2 ratio")
-    grid.ax_joint.set_ylabel("Difference from aCGH")
-    grid.ax_joint.axhline(c='k', lw=1, zorder=-10)
+def read_pair_values(fname):
+    """Load the paired value columns of a *.pair.csv or *.pair.npy table.
+
+    Binary (.npy) tables are memory-mapped, so only the two value columns are
+    actually read from disk.
+    """
+    if fname.endswith(".npy"):
+        table = numpy.load(fname, mmap_mode='r')
+        return numpy.asarray(table['value1']), numpy.asarray(table['value2'])
+    table = pandas.read_csv(fname, usecols=['value1', 'value2'])
+    return table['value1'].values, table['value2'].values
+
+
+def pair_diffs_means(fname):
+    """Differences (value2 - value1) and means of one pair table's values."""
+    value1, value2 = read_pair_values(fname)
+    if NEUTRAL_RANGE:
+        # Drop copy-number-neutral genes according to aCGH
+        keep = numpy.abs(value1) > NEUTRAL_RANGE
+        value1, value2 = value1[keep], value2[keep]
+    return value2 - value1, .5*(value1 + value2)
+
+
+def load_sketch(fname, sketch_dir=None):
+    """Get a quantile sketch of one pair table's differences.
+
+    `fname` may be a pair table or a sketch (.tdigest.npz) saved earlier. If
+    `sketch_dir` is given, each table's sketch is saved there and reused on
+    later runs, unless the table has been modified since. Saved sketches are
+    named by the table's base name and a hash of its absolute path, so tables
+    of the same name in different directories don't overwrite each other.
+    """
+    if fname.endswith(".tdigest.npz"):
+        return TDigest.load(fname)
+    sketch_fname = None
+    if sketch_dir:
+        path_hash = hashlib.sha1(
+            os.path.abspath(fname).encode('utf-8')).hexdigest()[:12]
+        sketch_fname = os.path.join(
+            sketch_dir, "%s.%s.tdigest.npz"
+            % (os.path.basename(fname).rsplit('.', 1)[0], path_hash))
+        if (os.path.isfile(sketch_fname) and
+            os.stat(sketch_fname).st_mtime >= os.stat(fname).st_mtime):
+            return TDigest.load(sketch_fname)
+    diffs, _means = pair_diffs_means(fname)
+    sketch = TDigest.from_values(diffs)
+    if sketch_fname:
+        if not os.path.isdir(sketch_dir):
+            os.makedirs(sketch_dir)
+        sketch.save(sketch_fname)
+    return sketch
+
+
+def stream_limits(name, fnames, sketch_dir=None):
+    """Limits of agreement from merged per-sample sketches.
+
+    Only one pair table is held in memory at a time; tables with an
+    up-to-date saved sketch are not read at all. Writes <name>.limits.tsv.
+    """
+    sketches = [load_sketch(fname, sketch_dir) for fname in fnames]
+    cohort = sketches[0].merge(*sketches[1:])
+    low, mid, hi = cohort.percentile([2.5, 50.0, 97.5])
+    table = pandas.DataFrame({
+        "Name": [name],
+        "Spread95": hi - low,
+        "Median": mid,
+        "Low95": low,
+        "High95": hi,
+        "N": int(cohort.count),
+    }, columns=["Name", "Spread95", "Median", "Low95", "High95", "N"])
+    fname = name + ".limits.tsv"
+    table.to_csv(fname, sep='\t', float_format="%.5f", index=False)
+    print("Wrote", fname, file=sys.stderr)
+    return table
+
+
+def write_diffs(name, diffs, binary=False):
+    """Save the differences as text (.diffs.dat) or binary (.diffs.npy)."""
+    if binary:
+        fname = name + ".diffs.npy"
+        numpy.save(fname, numpy.asarray(diffs, dtype=numpy.float64))
+    else:
+        fname = name + ".diffs.dat"
+        with open(fname, 'w') as handle:
+            handle.writelines("%s\n" % d for d in diffs)
+    print("Wrote", fname, file=sys.stderr)
+
+
+def plot_diffs_vs_means(name, diffs, means, density=False):
+    if density:
+        # Bin the points first; the plot size doesn't grow with the data
+        dgrid = density2d.DensityGrid.from_points(means, diffs,
+                                                  bins=(120, 60),
+                                                  ylim=(-2.0, 2.0))
+        _fig, ax_joint, _ax_x, _ax_y = density2d.plot_density(dgrid, size=6,
+                                                              space=0)
+    else:
+        grid = seaborn.jointplot(means, diffs, kind='scatter', stat_func=None,
+                                 space=0, size=6, ylim=(-2.0, 2.0),
+                                 marginal_kws={'bins': 60,
+                                               'hist_kws': {
+                                                   'histtype': 'stepfilled',
+                                                   'range': (-2, 2),
+                                               }},
+                                 joint_kws={'alpha': 0.2})
+        ax_joint = grid.ax_joint
+    ax_joint.set_xlabel("Mean estimated log2 ratio")
+    ax_joint.set_ylabel("Difference from aCGH")
+    ax_joint.axhline(c='k', lw=1, zorder=-10)
 
     # Limits of reliability at 95%
     low, mid, hi = numpy.percentile(diffs, [2.5, 50.0, 97.5])
-    grid.ax_joint.axhline(mid, c='k', ls=':', lw=1, zorder=-11)
-    grid.ax_joint.axhline(low, c='k', ls=':', lw=1, zorder=-11)
-    grid.ax_joint.axhline(hi, c='k', ls=':', lw=1, zorder=-11)
+    ax_joint.axhline(mid, c='k', ls=':', lw=1, zorder=-11)
+    ax_joint.axhline(low, c='k', ls=':', lw=1, zorder=-11)
+    ax_joint.axhline(hi, c='k', ls=':', lw=1, zorder=-11)
 
     fig_fname = name + ".alt.pdf"
     pyplot.savefig(fig_fname, format='pdf', bbox_inches="tight")
@@ -48,27 +153,38 @@ def plot_diffs_vs_means(name, diffs, means):
 if __name__ == '__main__':
     import argparse
     AP = argparse.ArgumentParser(description=__doc__)
-    AP.add_argument("fnames", nargs='+', help="*.pair.csv")
+    AP.add_argument("fnames", nargs='+',
+                    help="""*.pair.csv or *.pair.npy (or, with --stream,
+                    *.tdigest.npz sketches)""")
     AP.add_argument("-n", "--name", required=True, help="Name")
+    AP.add_argument("-b", "--binary", action='store_true',
+                    help="""Write the differences to <name>.diffs.npy instead
+                    of the plain-text <name>.diffs.dat.""")
+    AP.add_argument("-d", "--density", action='store_true',
+                    help="""Draw the plot as a binned density image instead of
+                    a scatter of every gene.""")
+    AP.add_argument("-s", "--stream", action='store_true',
+                    help="""Only calculate the limits of agreement, by merging
+                    per-sample quantile sketches, and write them to
+                    <name>.limits.tsv. Skips the plot and .diffs file.""")
+    AP.add_argument("--sketch-dir",
+                    help="""With --stream, save each table's sketch in this
+                    directory and reuse it on later runs.""")
     args = AP.parse_args()
 
+    if args.stream:
+        stream_limits(args.name, args.fnames, args.sketch_dir)
+        sys.exit()
+
     all_diffs = []
     all_means = []
     for fname in args.fnames:
-        table = pandas.read_csv(fname)
-        if NEUTRAL_RANGE:
-            # Drop copy-number-neutral genes according to aCGH
-            table = table[table['value1'].abs() > NEUTRAL_RANGE]
-        # Compute
-        diffs = table['value2'] - table['value1']
-        means = .5*(table['value1'] + table['value2'])
+        diffs, means = pair_diffs_means(fname)
         # plot_diffs_vs_means(basename(fname).split('.', 1)[0], diffs, means)
         all_diffs.append(diffs)
         all_means.append(means)
 
-    plot_diffs_vs_means(args.name,
-                        numpy.concatenate(all_diffs),
-                        numpy.concatenate(all_means))
-    with open(args.name + ".diffs.dat", 'w') as handle:
-        handle.writelines("%s\n" % d for d in numpy.concatenate(all_diffs))
-
+    all_diffs = numpy.concatenate(all_diffs)
+    plot_diffs_vs_means(args.name, all_diffs, numpy.concatenate(all_means),
+                        args.density)
+    write_diffs(args.name, all_diffs, args.binary)
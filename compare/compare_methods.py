@@ -3,7 +3,6 @@
 """Plot each method's distribution of residuals as a boxplot."""
 from __future__ import division, print_function
 
-import os
 import sys
 import argparse
 
@@ -12,77 +11,31 @@ import pandas as pd
 import seaborn as sn
 from matplotlib import pyplot as plt
 
+import load_diffs
+
 sn.set_style("darkgrid")
 Y_RANGE = 0.35
 
 def get_argparser():
     AP = argparse.ArgumentParser(description=__doc__)
-    AP.add_argument("cnvkit_pool_tr", help="CNVkit (TR cohort, pooled)")
-    AP.add_argument("cnvkit_pair_tr", help="CNVkit (TR cohort, paired)")
-    AP.add_argument("cnvkit_flat_tr", help="CNVkit (TR cohort, flat ref.)")
-    AP.add_argument("copywriter_pair_tr", help="CopywriteR (TR cohort, paired)")
-    AP.add_argument("copywriter_noref_tr", help="CopywriteR (TR cohort, no ref.)")
-    AP.add_argument("contra_pool_tr", help="CONTRA (TR cohort, pooled)")
-    AP.add_argument("contra_pair_tr", help="CONTRA (TR cohort, paired)")
-
-    AP.add_argument("cnvkit_pool_ex", help="CNVkit (EX cohort, pooled)")
-    AP.add_argument("cnvkit_pair_ex", help="CNVkit (EX cohort, paired)")
-    AP.add_argument("cnvkit_flat_ex", help="CNVkit (EX cohort, flat ref.)")
-    AP.add_argument("copywriter_pair_ex", help="CopywriteR (EX cohort, paired)")
-    AP.add_argument("copywriter_noref_ex", help="CopywriteR (EX cohort, no ref.)")
-    AP.add_argument("contra_pool_ex", help="CONTRA (EX cohort, pooled)")
-    AP.add_argument("contra_pair_ex", help="CONTRA (EX cohort, paired)")
-
-    AP.add_argument("cnvkit_pool_cl", help="CNVkit (CL cohort, pooled)")
-    AP.add_argument("cnvkit_pair_cl", help="CNVkit (CL cohort, paired)")
-    AP.add_argument("cnvkit_flat_cl", help="CNVkit (CL cohort, flat ref.)")
-    AP.add_argument("copywriter_pair_cl", help="CopywriteR (CL cohort, paired)")
-    AP.add_argument("copywriter_noref_cl", help="CopywriteR (CL cohort, no ref.)")
-    AP.add_argument("contra_pool_cl", help="CONTRA (CL cohort, pooled)")
-    AP.add_argument("contra_pair_cl", help="CONTRA (CL cohort, paired)")
-
+    load_diffs.add_loader_args(AP)
+    AP.add_argument("-b", "--bootstrap", type=int, default=0, metavar="N",
+                    help="""Add 95%% bootstrap confidence intervals for each
+                    method's Spread95 and Median to the stats table, using N
+                    bootstrap replicates (e.g. 10000). [Default: off]""")
+    AP.add_argument("--seed", type=int,
+                    help="Random seed for the bootstrap.")
     AP.add_argument("-o", "--output", help="Output PDF filename.")
     return AP
 
 
 def load_inputs(args):
-    return pd.concat([
-        as_dframe(args.cnvkit_pool_tr, 'CNVkit\npooled', 'TR'),
-        as_dframe(args.cnvkit_pair_tr, 'CNVkit\npaired', 'TR'),
-        as_dframe(args.cnvkit_flat_tr, 'CNVkit\nno ref.', 'TR'),
-        as_dframe(args.copywriter_pair_tr, 'CopywriteR\npaired', 'TR'),
-        as_dframe(args.copywriter_noref_tr, 'CopywriteR\nno ref.', 'TR'),
-        as_dframe(args.contra_pool_tr, 'CONTRA\npooled', 'TR'),
-        as_dframe(args.contra_pair_tr, 'CONTRA\npaired', 'TR'),
-
-        as_dframe(args.cnvkit_pool_ex, 'CNVkit\npooled', 'EX'),
-        as_dframe(args.cnvkit_pair_ex, 'CNVkit\npaired', 'EX'),
-        as_dframe(args.cnvkit_flat_ex, 'CNVkit\nno ref.', 'EX'),
-        as_dframe(args.copywriter_pair_ex, 'CopywriteR\npaired', 'EX'),
-        as_dframe(args.copywriter_noref_ex, 'CopywriteR\nno ref.', 'EX'),
-        as_dframe(args.contra_pool_ex, 'CONTRA\npooled', 'EX'),
-        as_dframe(args.contra_pair_ex, 'CONTRA\npaired', 'EX'),
-
-        as_dframe(args.cnvkit_pool_cl, 'CNVkit\npooled', 'CL'),
-        as_dframe(args.cnvkit_pair_cl, 'CNVkit\npaired', 'CL'),
-        as_dframe(args.cnvkit_flat_cl, 'CNVkit\nno ref.', 'CL'),
-        as_dframe(args.copywriter_pair_cl, 'CopywriteR\npaired', 'CL'),
-        as_dframe(args.copywriter_noref_cl, 'CopywriteR\nno ref.', 'CL'),
-        as_dframe(args.contra_pool_cl, 'CONTRA\npooled', 'CL'),
-        as_dframe(args.contra_pair_cl, 'CONTRA\npaired', 'CL'),
-    ], ignore_index=True)
-
-
-def as_dframe(fname, method, cohort):
-    """Load an aCGH-vs-method file as a DataFrame. Print summary stats."""
-    if fname and os.stat(fname).st_size > 1:
-        arr = np.loadtxt(fname)
-        print("Loaded", fname, file=sys.stderr)
-    else:
-        # Dummy data
-        print("Dummy data for:", cohort, method, file=sys.stderr)
-        arr = np.random.triangular(-1.0, 0, 1.0, 300)
-    return pd.DataFrame({"Difference": arr, "Method": method, "Cohort": cohort})
+    """Load the TR, EX and CL cohorts' differences for every method.
+
+    e.g. tr-cnvkit-pool.diffs.dat ... cl-contra-pair.diffs.dat, or the
+    equivalent manifest.
+    """
+    return load_diffs.load_from_args(args)
 
 
 def blank_dframe(method, cohort):
@@ -110,9 +63,48 @@ def make_plot(data):
 
 
 
-def label_plot(grid):
+def bootstrap_percentiles(arr, n_boot, percentiles=(2.5, 50.0, 97.5),
+                          rng=np.random):
+    """Bootstrap distribution of the given percentiles of `arr`.
+
+    Equivalent to drawing an (n_boot x n) matrix of resampling indices and
+    taking `np.percentile` of each resampled row, but only the order
+    statistics that each percentile interpolates between are drawn. The
+    sorted positions of n indices drawn uniformly are uniform order
+    statistics, which can be drawn jointly as successive Beta-distributed
+    gaps, so the cost is O(n_boot) per percentile rather than O(n_boot * n).
+
+    Returns an array of shape (n_boot, len(percentiles)).
+    """
+    arr = np.sort(np.asarray(arr))
+    size = len(arr)
+    # Same linear interpolation as np.percentile
+    positions = (size - 1) * np.asarray(percentiles, dtype=float) / 100.
+    lower = np.floor(positions).astype(int)
+    upper = np.minimum(lower + 1, size - 1)
+    frac = positions - lower
+    ranks = np.unique(np.concatenate([lower, upper]))
+    # Uniform order statistics at each 0-based rank, drawn in increasing order
+    uniforms = np.empty((n_boot, len(ranks)))
+    prev_rank = -1
+    prev_u = np.zeros(n_boot)
+    for i, rank in enumerate(ranks):
+        prev_u = prev_u + (1 - prev_u) * rng.beta(rank - prev_rank,
+                                                    size - rank, n_boot)
+        uniforms[:, i] = prev_u
+        prev_rank = rank
+    values = arr[np.minimum((uniforms * size).astype(int), size - 1)]
+    low_vals = values[:, np.searchsorted(ranks, lower)]
+    high_vals = values[:, np.searchsorted(ranks, upper)]
+    return low_vals + (high_vals - low_vals) * frac
+
+
+def label_plot(grid, n_boot=0, rng=np.random):
     """Calculate summary statistics and label the plot with them.
 
+    If `n_boot` is given, also estimate 95% bootstrap confidence intervals
+    for Spread95 and Median from that many replicates.
+
     Return a dataframe of the summary stats.
     """
     # columns = ["Cohort", "Method", "Mean", "Spread", "Limit", "Low95", "Median", "High95",
@@ -127,7 +119,7 @@ def label_plot(grid):
             arr = np.asarray(group.Difference)
             low, mid, hi = np.percentile(arr, [2.5, 50.0, 97.5])
             spread = hi - low
-            dframes.append(pd.DataFrame.from_items([
+            items = [
                 ("Cohort", [cohort]),
                 ("Method", method.replace('\n', '_')),
                 ("Spread95", spread),
@@ -138,7 +130,19 @@ def label_plot(grid):
                 ("High95", hi),
                 ("MaxAbs", np.absolute(arr).max()),
                 ("N", len(arr)),
-            ]))
+            ]
+            if n_boot:
+                boots = bootstrap_percentiles(arr, n_boot, rng=rng)
+                spread_ci = np.percentile(boots[:, 2] - boots[:, 0],
+                                          [2.5, 97.5])
+                median_ci = np.percentile(boots[:, 1], [2.5, 97.5])
+                items.extend([
+                    ("Spread95_CILow", spread_ci[0]),
+                    ("Spread95_CIHigh", spread_ci[1]),
+                    ("Median_CILow", median_ci[0]),
+                    ("Median_CIHigh", median_ci[1]),
+                ])
+            dframes.append(pd.DataFrame.from_items(items))
             ax.get_ygridlines()[4].set_linewidth(3.0)
             if low > -Y_RANGE + .02:
                 ax.text(idx,
@@ -175,7 +179,8 @@ def test_data():
 
 if __name__ == '__main__':
     args = get_argparser().parse_args()
-    stats = label_plot(make_plot(load_inputs(args)))
+    stats = label_plot(make_plot(load_inputs(args)), args.bootstrap,
+                       np.random.RandomState(args.seed))
     stats.to_csv(sys.stdout, sep='\t', float_format="%.5f", index=False)
 
     if args.output:
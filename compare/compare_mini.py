@@ -3,7 +3,6 @@
 """Plot each method's distribution of residuals as a boxplot."""
 from __future__ import division, print_function
 
-import os
 import sys
 import argparse
 
@@ -12,48 +11,21 @@ import pandas as pd
 import seaborn as sn
 from matplotlib import pyplot as plt
 
+import load_diffs
+
 sn.set_style("darkgrid")
 Y_RANGE = 0.35
 
 def get_argparser():
     AP = argparse.ArgumentParser(description=__doc__)
-    AP.add_argument("cnvkit_pool_tr", help="CNVkit (TR cohort, pooled)")
-    AP.add_argument("cnvkit_pair_tr", help="CNVkit (TR cohort, paired)")
-    AP.add_argument("cnvkit_flat_tr", help="CNVkit (TR cohort, flat ref.)")
-    AP.add_argument("cnvkit_pool_ex", help="CNVkit (EX cohort, pooled)")
-    AP.add_argument("cnvkit_pair_ex", help="CNVkit (EX cohort, paired)")
-    AP.add_argument("cnvkit_flat_ex", help="CNVkit (EX cohort, flat ref.)")
-    AP.add_argument("cnvkit_pool_cl", help="CNVkit (CL cohort, pooled)")
-    AP.add_argument("cnvkit_pair_cl", help="CNVkit (CL cohort, paired)")
-    AP.add_argument("cnvkit_flat_cl", help="CNVkit (CL cohort, flat ref.)")
+    load_diffs.add_loader_args(AP)
     AP.add_argument("-o", "--output", help="Output PDF filename.")
     return AP
 
 
 def load_inputs(args):
-    return pd.concat([
-        as_dframe(args.cnvkit_pool_tr, 'CNVkit\npooled', 'TR'),
-        as_dframe(args.cnvkit_pair_tr, 'CNVkit\npaired', 'TR'),
-        as_dframe(args.cnvkit_flat_tr, 'CNVkit\nno ref.', 'TR'),
-        as_dframe(args.cnvkit_pool_ex, 'CNVkit\npooled', 'EX'),
-        as_dframe(args.cnvkit_pair_ex, 'CNVkit\npaired', 'EX'),
-        as_dframe(args.cnvkit_flat_ex, 'CNVkit\nno ref.', 'EX'),
-        as_dframe(args.cnvkit_pool_cl, 'CNVkit\npooled', 'CL'),
-        as_dframe(args.cnvkit_pair_cl, 'CNVkit\npaired', 'CL'),
-        as_dframe(args.cnvkit_flat_cl, 'CNVkit\nno ref.', 'CL'),
-    ], ignore_index=True)
-
-
-def as_dframe(fname, method, cohort):
-    """Load an aCGH-vs-method file as a DataFrame. Print summary stats."""
-    if fname and os.stat(fname).st_size > 1:
-        arr = np.loadtxt(fname)
-        print("Loaded", fname, file=sys.stderr)
-    else:
-        # Dummy data
-        print("Dummy data for:", cohort, method, file=sys.stderr)
-        arr = np.random.triangular(-1.0, 0, 1.0, 300)
-    return pd.DataFrame({"Difference": arr, "Method": method, "Cohort": cohort})
+    """Load the CNVkit pooled, paired and flat differences for each cohort."""
+    return load_diffs.load_from_args(args)
 
 
 def blank_dframe(method, cohort):
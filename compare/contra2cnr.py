@@ -27,22 +27,32 @@ Column names::
                     BinNumber                   2
 """
 
-import argparse
 import pandas as pd
 from cnvlib.cnary import CopyNumArray as CNA
 
+import contra_batch
 
-AP = argparse.ArgumentParser(description=__doc__)
-AP.add_argument('contra_table')
-AP.add_argument('-o', '--output')
-args = AP.parse_args()
-
-d = pd.read_table(args.contra_table)
-cnarr = CNA.from_columns(dict(
-    chromosome=d['Chr'],
-    start=d['OriStCoordinate'],
-    end=d['OriEndCoordinate'],
-    gene=d['Gene.Sym'],
-    log2=d['Adjusted.Mean.of.LogRatio']))
-cnarr.sort()
-cnarr.write(args.output)
+# Only these columns are read, and with fixed types
+COLUMNS = {
+    'Chr': str,
+    'OriStCoordinate': int,
+    'OriEndCoordinate': int,
+    'Gene.Sym': str,
+    'Adjusted.Mean.of.LogRatio': float,
+}
+
+
+def convert(contra_table):
+    d = pd.read_table(contra_table, usecols=list(COLUMNS), dtype=COLUMNS)
+    cnarr = CNA.from_columns(dict(
+        chromosome=d['Chr'],
+        start=d['OriStCoordinate'],
+        end=d['OriEndCoordinate'],
+        gene=d['Gene.Sym'],
+        log2=d['Adjusted.Mean.of.LogRatio']))
+    cnarr.sort()
+    return cnarr
+
+
+if __name__ == '__main__':
+    contra_batch.main(__doc__, convert, '.cnr')
@@ -16,23 +16,34 @@ Column names::
     gene          = Calls                 No
 """
 
-import argparse
 import pandas as pd
 from cnvlib.cnary import CopyNumArray as CNA
 
+import contra_batch
 
-AP = argparse.ArgumentParser(description=__doc__)
-AP.add_argument('contra_cbs1')
-AP.add_argument('-o', '--output')
-args = AP.parse_args()
-
-d = pd.read_table(args.contra_cbs1)
-cnarr = CNA.from_columns(dict(
-    chromosome=d['Chr'],
-    start=d['OriStCoordinate'],
-    end=d['OriEndCoordinate'],
-    gene=d['Calls'],
-    log2=d['LogRatios'],
-    probes=d['NumberOfTargets']))
-cnarr.sort()
-cnarr.write(args.output)
+# Only these columns are read, and with fixed types
+COLUMNS = {
+    'Chr': str,
+    'OriStCoordinate': int,
+    'OriEndCoordinate': int,
+    'Calls': str,
+    'LogRatios': float,
+    'NumberOfTargets': int,
+}
+
+
+def convert(contra_cbs1):
+    d = pd.read_table(contra_cbs1, usecols=list(COLUMNS), dtype=COLUMNS)
+    cnarr = CNA.from_columns(dict(
+        chromosome=d['Chr'],
+        start=d['OriStCoordinate'],
+        end=d['OriEndCoordinate'],
+        gene=d['Calls'],
+        log2=d['LogRatios'],
+        probes=d['NumberOfTargets']))
+    cnarr.sort()
+    return cnarr
+
+
+if __name__ == '__main__':
+    contra_batch.main(__doc__, convert, '.cns')
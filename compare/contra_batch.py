@@ -0,0 +1,64 @@
+"""Command-line batch conversion shared by contra2cnr.py and contra2cns.py.
+
+Each converter supplies only a function reading one CONTRA table into a
+CopyNumArray; this module converts one table to a named output, or many
+tables into <sample><suffix> files, in a pool of worker processes. Outputs
+newer than their input table and the converter scripts are skipped.
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+import batch_jobs
+
+
+def convert_write(job, convert):
+    contra_table, output = job
+    convert(contra_table).write(output)
+    return output
+
+
+def output_name(contra_table, output_dir, suffix):
+    """e.g. dir/EX_11_T.CNATable.csv -> <output_dir>/EX_11_T<suffix>"""
+    sample_id = os.path.basename(contra_table).split('.', 1)[0]
+    return os.path.join(output_dir, sample_id + suffix)
+
+
+def main(description, convert, default_suffix):
+    """Parse the command line and convert the given tables."""
+    AP = argparse.ArgumentParser(description=description)
+    AP.add_argument('contra_tables', nargs='+')
+    AP.add_argument('-o', '--output',
+                    help="Output file name, if converting only one table.")
+    AP.add_argument('-d', '--output-dir', default='.',
+                    help="""Directory for the outputs, named <sample><suffix>,
+                    when converting several tables. [Default: %(default)s]""")
+    AP.add_argument('-s', '--suffix', default=default_suffix,
+                    help="""Output file name suffix following the sample ID
+                    (the input name up to the first '.').
+                    [Default: %(default)s]""")
+    AP.add_argument('-f', '--force', action='store_true',
+                    help="""Convert all tables, even those whose outputs are
+                    newer than the inputs (and the converter).""")
+    AP.add_argument('-p', '--processes', type=int,
+                    help="Number of worker processes. [Default: all CPUs]")
+    args = AP.parse_args()
+
+    if args.output:
+        if len(args.contra_tables) > 1:
+            AP.error("-o/--output can only be used with a single input")
+        jobs = [(args.contra_tables[0], args.output)]
+    else:
+        jobs = [(fname, output_name(fname, args.output_dir, args.suffix))
+                for fname in args.contra_tables]
+        if not args.force:
+            scripts = [sys.argv[0], __file__]
+            jobs = [job for job in jobs
+                    if not batch_jobs.is_current(job[1], [job[0]] + scripts)]
+    for _output in batch_jobs.imap_jobs(convert_write, jobs, args.processes,
+                                        shared=convert):
+        pass
@@ -0,0 +1,175 @@
+"""Load the aCGH-vs-method differences (*.diffs.dat) for the comparison plots.
+
+The inputs are listed in a manifest, a tab-separated table with the columns
+``cohort``, ``method`` and ``path``, e.g.::
+
+    cohort  method          path
+    TR      cnvkit-pool     tr-cnvkit-pool.diffs.dat
+    TR      contra-pair     tr-contra-pair.diffs.dat
+
+Relative paths are taken relative to the manifest's directory. Files named in
+the usual ``<cohort>-<method>.diffs.dat`` pattern can also be listed directly,
+and the cohort and method are taken from the file name.
+
+Files are parsed in a pool of worker processes. Optionally each parsed file is
+cached as .npy under the hash of its contents, so after one method's output
+changes, only that file is parsed again.
+"""
+from __future__ import division, print_function
+
+import hashlib
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+from batch_jobs import imap_jobs
+
+METHOD_LABELS = {
+    'cnvkit-pool': 'CNVkit\npooled',
+    'cnvkit-pair': 'CNVkit\npaired',
+    'cnvkit-flat': 'CNVkit\nno ref.',
+    'copywriter-pair': 'CopywriteR\npaired',
+    'copywriter-noref': 'CopywriteR\nno ref.',
+    'contra-pool': 'CONTRA\npooled',
+    'contra-pair': 'CONTRA\npaired',
+    # Subsets of the CNVkit tables (compare_mini.py)
+    'mini-pool': 'CNVkit\npooled',
+    'mini-pair': 'CNVkit\npaired',
+    'mini-flat': 'CNVkit\nno ref.',
+}
+
+
+def read_manifest(fname):
+    """Read a manifest of (cohort, method, path) entries."""
+    table = pd.read_csv(fname, sep='\t', comment='#', dtype=str)
+    missing = {'cohort', 'method', 'path'}.difference(table.columns)
+    if missing:
+        raise ValueError("Manifest %s is missing column(s): %s"
+                         % (fname, ', '.join(sorted(missing))))
+    basedir = os.path.dirname(fname)
+    return [(cohort, method, os.path.join(basedir, path))
+            for cohort, method, path
+            in zip(table.cohort, table.method, table.path)]
+
+
+def entries_from_paths(paths):
+    """Derive (cohort, method, path) entries from '<cohort>-<method>' names.
+
+    e.g. 'tr-cnvkit-pool.diffs.dat' -> ('TR', 'cnvkit-pool', ...)
+    """
+    entries = []
+    for path in paths:
+        stem = os.path.basename(path).split('.', 1)[0]
+        if '-' not in stem:
+            raise ValueError("Can't tell cohort and method from file name: "
+                             + path)
+        cohort, method = stem.split('-', 1)
+        entries.append((cohort.upper(), method, path))
+    return entries
+
+
+def load_entries(entries, processes=None, cache_dir=None):
+    """Load all listed diffs files into one DataFrame.
+
+    Empty files are replaced with dummy data; missing files are an error.
+
+    Returns a pandas.DataFrame with columns Cohort, Method and Difference.
+    """
+    paths = [path for _cohort, _method, path in entries]
+    arrays = list(imap_jobs(_load_job, paths, processes, shared=cache_dir))
+
+    cohorts = []
+    methods = []
+    for idx, (cohort, method, path) in enumerate(entries):
+        if arrays[idx] is None:
+            # Dummy data
+            print("Dummy data for:", cohort, method, file=sys.stderr)
+            arrays[idx] = np.random.triangular(-1.0, 0, 1.0, 300)
+        else:
+            print("Loaded", path, file=sys.stderr)
+        cohorts.append((cohort, len(arrays[idx])))
+        methods.append((METHOD_LABELS.get(method, method), len(arrays[idx])))
+    return pd.DataFrame({
+        "Cohort": _repeat_labels(cohorts),
+        "Method": _repeat_labels(methods),
+        "Difference": np.concatenate(arrays),
+    }, columns=["Cohort", "Method", "Difference"])
+
+
+def _repeat_labels(labels_sizes):
+    """Expand (label, count) pairs into a column of labels."""
+    return np.repeat(np.array([label for label, _size in labels_sizes],
+                              dtype=object),
+                     [size for _label, size in labels_sizes])
+
+
+def _load_job(path, cache_dir):
+    """Parse one diffs file, via the cache if given. None if empty."""
+    if not path or os.stat(path).st_size <= 1:
+        return None
+    if not cache_dir:
+        return read_diffs(path)
+    cache_fname = os.path.join(cache_dir, file_digest(path) + ".npy")
+    if os.path.isfile(cache_fname):
+        return np.load(cache_fname)
+    arr = read_diffs(path)
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # Another worker got there first
+            pass
+    # Write-then-rename so concurrent runs never see a partial file
+    tmp_fname = "%s.%d.tmp.npy" % (cache_fname[:-4], os.getpid())
+    np.save(tmp_fname, arr)
+    os.rename(tmp_fname, cache_fname)
+    return arr
+
+
+def read_diffs(path):
+    """Read one diffs file, text (.dat) or binary (.npy)."""
+    if path.endswith(".npy"):
+        # Binary output of alt.py -b
+        return np.load(path, mmap_mode='r')
+    return np.loadtxt(path, ndmin=1)
+
+
+def file_digest(path, blocksize=1 << 20):
+    """SHA-1 hex digest of a file's contents."""
+    sha = hashlib.sha1()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(blocksize), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def add_loader_args(AP, fnames_help=None):
+    """Add the shared input options to a script's argument parser."""
+    AP.add_argument("fnames", nargs='*',
+                    help=fnames_help or """Differences files named
+                    <cohort>-<method>.diffs.dat (or .npy).""")
+    AP.add_argument("-m", "--manifest",
+                    help="""Tab-separated manifest of inputs, with columns
+                    cohort, method, path. Used instead of the positional
+                    file names.""")
+    AP.add_argument("-p", "--processes", type=int,
+                    help="Number of worker processes for loading [all CPUs].")
+    AP.add_argument("--cache",
+                    help="""Directory in which to cache parsed inputs, keyed
+                    on file contents.""")
+    return AP
+
+
+def load_from_args(args):
+    """Load the inputs named by the options from `add_loader_args`."""
+    if args.manifest:
+        entries = read_manifest(args.manifest)
+    elif args.fnames:
+        entries = entries_from_paths(args.fnames)
+    else:
+        raise ValueError("No inputs given; use file names or --manifest")
+    return load_entries(entries, args.processes, args.cache)
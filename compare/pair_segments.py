@@ -3,6 +3,7 @@
 """Match up and aggregate gene coverages between 2 sets of samples."""
 from __future__ import division, print_function
 
+import os
 import sys
 
 import numpy as np
@@ -11,15 +12,20 @@ import cnvlib
 from cnvlib import params
 from cnvlib.rary import RegionArray as RA
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+from pair_tables import write_table
+
 
 # --- by targeted interval ---
 
-def read_paired_genes(cbs1, cbs2, interval):
+def read_paired_genes(cbs1, cbs2, interval, how="median"):
     """Get the segment CN values for each targeted region.
 
     Get overlapping regions of two paired segment/gene sets.
 
-    For genes with 2 or more segments, take the median value of the segments.
+    For genes with 2 or more segments, take the median value of the segments
+    (or, with how='mean', the mean weighted by each segment's overlap).
 
     Return a pandas.DataFrame with columns:
         chrom, start, end, label, value1, value2
@@ -37,10 +43,8 @@ def read_paired_genes(cbs1, cbs2, interval):
     genes = interval2genes(interval)
     print("#Genes tiled:", len(genes), file=sys.stderr)
 
-    genes["value1"] = [segment_cn(sel)
-                       for (_r, sel) in segments1.by_ranges(genes, mode="trim")]
-    genes["value2"] = [segment_cn(sel)
-                       for (_r, sel) in segments2.by_ranges(genes, mode="trim")]
+    genes["value1"], genes["value2"] = overlap_cn(genes, segments1,
+                                                  segments2, how=how)
     genes = genes.data.dropna()
     print("#Genes after dropna:", len(genes), file=sys.stderr)
     return genes
@@ -61,6 +65,107 @@ def segment_cn(segset):
         return segset.log2.median()
 
 
+def overlap_cn(genes, *segment_sets, **kwargs):
+    """Summarize the segment log2 values overlapping each gene, in bulk.
+
+    Equivalent to calling `segment_cn` on each selection yielded by
+    ``segments.by_ranges(genes, mode="trim")``, but each chromosome is handled
+    with one pair of `searchsorted` calls per segment set, and the median (or
+    overlap-weighted mean) of multi-segment genes is taken over a single
+    sorted, flattened array instead of one pandas call per gene.
+
+    Segments within each set are assumed sorted and non-overlapping, as in a
+    .cns file.
+
+    Parameters
+    ----------
+    genes : RegionArray
+        Gene regions, e.g. from `interval2genes`.
+    *segment_sets : CopyNumArray
+        One or more segment sets to summarize over the same genes.
+    how : str
+        'median' (default, same as `segment_cn`) or 'mean' to weight each
+        segment's log2 value by its trimmed overlap with the gene.
+
+    Returns
+    -------
+    list of np.ndarray
+        One float array per segment set, aligned to the rows of `genes`; NaN
+        where no segment overlaps the gene.
+    """
+    how = kwargs.pop("how", "median")
+    if kwargs:
+        raise TypeError("Unexpected keyword arguments: %s"
+                        % ', '.join(kwargs))
+    if how not in ("median", "mean"):
+        raise ValueError("Unknown summary method: %r" % how)
+
+    gdata = genes.data
+    # Group the gene rows by chromosome once, shared by all segment sets
+    gene_chroms = [(chrom, np.flatnonzero(gdata.chromosome.values == chrom))
+                   for chrom in gdata.chromosome.unique()]
+    gene_starts = gdata.start.values
+    gene_ends = gdata.end.values
+    results = []
+    for segments in segment_sets:
+        sdata = segments.data
+        # pandas' median skips NaN; dropping those segments up front is
+        # equivalent and keeps the flattened arrays NaN-free
+        sdata = sdata[sdata.log2.notnull()]
+        seg_chroms = sdata.chromosome.values
+        values = np.empty(len(gdata), dtype=float)
+        values.fill(np.nan)
+        for chrom, gene_idx in gene_chroms:
+            seg_mask = (seg_chroms == chrom)
+            if not seg_mask.any():
+                continue
+            values[gene_idx] = _chrom_overlap_cn(sdata.start.values[seg_mask],
+                                                 sdata.end.values[seg_mask],
+                                                 sdata.log2.values[seg_mask],
+                                                 gene_starts[gene_idx],
+                                                 gene_ends[gene_idx],
+                                                 how)
+        results.append(values)
+    return results
+
+
+def _chrom_overlap_cn(seg_starts, seg_ends, seg_log2, starts, ends, how):
+    """Summarize overlapping segment values for genes on one chromosome."""
+    # Same slicing rule as by_ranges on non-nested regions
+    lo = np.searchsorted(seg_ends, starts, "right")
+    hi = np.searchsorted(seg_starts, ends, "left")
+    counts = np.maximum(hi - lo, 0)
+    out = np.empty(len(starts), dtype=float)
+    out.fill(np.nan)
+    single = (counts == 1)
+    out[single] = seg_log2[lo[single]]
+    multi = np.flatnonzero(counts > 1)
+    if not len(multi):
+        return out
+
+    # Flatten the (gene, segment) overlap pairs of multi-segment genes
+    mcounts = counts[multi]
+    offsets = np.concatenate(([0], np.cumsum(mcounts)[:-1]))
+    group = np.repeat(np.arange(len(multi)), mcounts)
+    seg_idx = (np.repeat(lo[multi] - offsets, mcounts)
+               + np.arange(mcounts.sum()))
+    vals = seg_log2[seg_idx]
+    if how == "median":
+        # Sort values within each gene, then pick the middle element(s)
+        vals = vals[np.lexsort((vals, group))]
+        out[multi] = .5 * (vals[offsets + (mcounts - 1) // 2] +
+                           vals[offsets + mcounts // 2])
+    else:
+        # Weight by the segment's overlap with the gene, as with mode="trim"
+        weights = (np.minimum(seg_ends[seg_idx],
+                              np.repeat(ends[multi], mcounts))
+                   - np.maximum(seg_starts[seg_idx],
+                                np.repeat(starts[multi], mcounts)))
+        out[multi] = (np.bincount(group, weights * vals, len(multi)) /
+                      np.bincount(group, weights, len(multi)))
+    return out
+
+
 # ENH - port to GA/CNA.by_genes, .squash_genes
 def interval2genes(interval, min_gene_size=200):
     """Squash intervals into named genes."""
@@ -101,8 +206,9 @@ def interval2genes(interval, min_gene_size=200):
 
 def main(args):
     """Make and emit the table."""
-    table = read_paired_genes(args.asegment, args.bsegment, args.interval)
-    table.to_csv(args.output or sys.stdout, index=False)
+    table = read_paired_genes(args.asegment, args.bsegment, args.interval,
+                              args.method)
+    write_table(table, args.output)
 
 
 if __name__ == '__main__':
@@ -111,5 +217,11 @@ if __name__ == '__main__':
     AP.add_argument("asegment", help="Segmentation calls")
     AP.add_argument("bsegment", help="Segmentation calls")
     AP.add_argument("-i", "--interval", help="Target intervals list")
-    AP.add_argument("-o", "--output", help="Output CSV file name")
+    AP.add_argument("-m", "--method", choices=("median", "mean"),
+                    default="median",
+                    help="""How to summarize genes overlapping 2 or more
+                    segments: median of segment values (default), or mean
+                    weighted by overlap length.""")
+    AP.add_argument("-o", "--output",
+                    help="Output CSV (or binary .npy) file name")
     main(AP.parse_args())
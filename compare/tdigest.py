@@ -0,0 +1,109 @@
+"""Mergeable quantile sketch (t-digest) for streaming limits of agreement.
+
+A t-digest summarizes a distribution as weighted centroids, kept small near
+the tails (where the 2.5% and 97.5% limits are) and coarser in the middle.
+Digests of separate samples can be merged into a cohort-level digest without
+revisiting the raw values, and saved to / loaded from .npz files.
+
+See: Dunning & Ertl, "Computing extremely accurate quantiles using
+t-digests" (2019).
+"""
+from __future__ import division, print_function
+
+import numpy as np
+
+
+class TDigest(object):
+    """Weighted centroids approximating a distribution's quantiles.
+
+    `compression` bounds the number of centroids (roughly), trading size for
+    accuracy.
+    """
+
+    def __init__(self, means=(), weights=(), vmin=np.inf, vmax=-np.inf,
+                 compression=500):
+        self.means = np.asarray(means, dtype=float)
+        self.weights = np.asarray(weights, dtype=float)
+        self.vmin = vmin
+        self.vmax = vmax
+        self.compression = compression
+
+    @classmethod
+    def from_values(cls, values, compression=500):
+        """Build a digest from an array of values (NaNs are dropped)."""
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return cls(compression=compression)
+        digest = cls(values, np.ones(len(values)), values.min(), values.max(),
+                     compression)
+        return digest.compress()
+
+    @property
+    def count(self):
+        return self.weights.sum()
+
+    def __len__(self):
+        return len(self.means)
+
+    def merge(self, *others):
+        """Combine this digest with others into a new, compressed digest."""
+        digests = (self,) + others
+        merged = TDigest(np.concatenate([d.means for d in digests]),
+                         np.concatenate([d.weights for d in digests]),
+                         min(d.vmin for d in digests),
+                         max(d.vmax for d in digests),
+                         max(d.compression for d in digests))
+        return merged.compress()
+
+    def compress(self):
+        """Merge neighboring centroids that fall in the same unit of scale."""
+        if not len(self.means):
+            return self
+        order = np.argsort(self.means, kind='mergesort')
+        means = self.means[order]
+        weights = self.weights[order]
+        total = weights.sum()
+        # Scale function k1: clusters are narrow near q=0 and q=1
+        q_mid = (np.cumsum(weights) - .5 * weights) / total
+        k = (self.compression / (2 * np.pi)) * np.arcsin(2 * q_mid - 1)
+        cluster = np.floor(k).astype(int)
+        # Boundaries between runs of the same cluster index
+        starts = np.flatnonzero(np.concatenate(([True],
+                                                cluster[1:] != cluster[:-1])))
+        new_weights = np.add.reduceat(weights, starts)
+        new_means = np.add.reduceat(means * weights, starts) / new_weights
+        return TDigest(new_means, new_weights, self.vmin, self.vmax,
+                       self.compression)
+
+    def quantile(self, q):
+        """Estimate the quantile(s) at q, in [0, 1]."""
+        q = np.asarray(q, dtype=float)
+        if not len(self.means):
+            return np.full(q.shape, np.nan)
+        total = self.weights.sum()
+        # Each centroid's mass is centered on its mean; interpolate between
+        # centroid centers, anchored at the observed min and max
+        centers = np.concatenate(([0.],
+                                  np.cumsum(self.weights) - .5 * self.weights,
+                                  [total]))
+        values = np.concatenate(([self.vmin], self.means, [self.vmax]))
+        return np.interp(q * total, centers, values)
+
+    def percentile(self, p):
+        """Estimate the percentile(s) at p, in [0, 100]."""
+        return self.quantile(np.asarray(p, dtype=float) / 100.)
+
+    def save(self, fname):
+        """Write the digest to a .npz file."""
+        np.savez(fname, means=self.means, weights=self.weights,
+                 bounds=np.array([self.vmin, self.vmax]),
+                 compression=np.array(self.compression))
+
+    @classmethod
+    def load(cls, fname):
+        """Read a digest written by `save`."""
+        with np.load(fname) as data:
+            vmin, vmax = data['bounds']
+            return cls(data['means'], data['weights'], vmin, vmax,
+                       int(data['compression']))
@@ -5,30 +5,21 @@ from __future__ import division, print_function
 
 import os
 import sys
-import itertools
 
 import numpy as np
 import pandas as pd
 import seaborn as sn
 from matplotlib import pyplot as plt
 
-# from compare_methods import as_dframe
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'compare'))
+import load_diffs
 
 
 sn.set(style="darkgrid", palette="Blues")
 Y_RANGE = 0.5
-
-
-def as_dframe(fname, method, cohort):
-    """Load an aCGH-vs-method file as a DataFrame. Print summary stats."""
-    if fname and os.stat(fname).st_size > 1:
-        arr = np.loadtxt(fname)
-        print("Loaded", fname, file=sys.stderr)
-    else:
-        # Dummy data
-        print("Dummy data for:", cohort, method, file=sys.stderr)
-        arr = np.random.triangular(-1.0, 0, 1.0, 300)
-    return pd.DataFrame({"Difference": arr, "Method": method, "Cohort": cohort})
+# Methods of the CL tables given by position, in order
+CL_METHODS = ('cnvkit-pool', 'cnvkit-pair', 'cnvkit-flat')
 
 
 def make_plot(data):
@@ -77,19 +68,23 @@ def label_plot(ax, data):
 if __name__ == '__main__':
     import argparse
     AP = argparse.ArgumentParser(description=__doc__)
-    AP.add_argument("tables", nargs='+',
-                    help="CL tables (CNVkit pooled, paired, flat)")
+    load_diffs.add_loader_args(AP, "CL tables (CNVkit pooled, paired, flat)")
     AP.add_argument("-o", "--output", help="Output PDF filename.")
     args = AP.parse_args()
 
-    # Load data
-    data = pd.concat([as_dframe(tbl, title, "CL")
-                      for tbl, title in itertools.izip(
-                          args.tables,
-                          ("CNVkit\npooled",
-                           'CNVkit\npaired',
-                           'CNVkit\nno ref.'))],
-                     ignore_index=True)
+    # Load data -- CL tables for CNVkit pooled, paired, flat
+    if args.manifest:
+        data = load_diffs.load_from_args(args)
+    elif args.fnames:
+        if len(args.fnames) > len(CL_METHODS):
+            AP.error("At most %d tables (CNVkit pooled, paired, flat)"
+                     % len(CL_METHODS))
+        data = load_diffs.load_entries(
+            [("CL", method, fname)
+             for fname, method in zip(args.fnames, CL_METHODS)],
+            args.processes, args.cache)
+    else:
+        AP.error("No inputs given; use file names or --manifest")
 
     ax = make_plot(data)
     stats = label_plot(ax, data)
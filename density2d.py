@@ -0,0 +1,176 @@
+"""Pre-aggregated 2-D density plots for very large paired datasets.
+
+Instead of handing every point to matplotlib (scatter, hexbin or seaborn's
+jointplot), the points are binned into a 2-D histogram with NumPy, which can
+be cached on disk, and the histogram is drawn as a single image with marginal
+histograms taken from the same counts. Drawing time and PDF size then depend
+on the grid size, not on the number of points.
+
+Used by compare/alt.py, cell/compare/plot_paired_segments.py, rna/plot2d.py
+and rna/plot_depth_vs_logr.py; scripts in subdirectories add this directory
+to sys.path to import it.
+"""
+from __future__ import division, print_function
+
+import hashlib
+import os
+
+import numpy as np
+from matplotlib import colors, pyplot
+
+
+class DensityGrid(object):
+    """Counts of points in a fixed grid of (x, y) bins."""
+
+    def __init__(self, xedges, yedges, counts=None):
+        self.xedges = np.asarray(xedges, dtype=float)
+        self.yedges = np.asarray(yedges, dtype=float)
+        if counts is None:
+            counts = np.zeros((len(self.xedges) - 1, len(self.yedges) - 1))
+        self.counts = np.asarray(counts, dtype=float)
+
+    @classmethod
+    def from_limits(cls, xlim, ylim, bins=100, xlog=False, ylog=False):
+        """Create an empty grid spanning the given limits.
+
+        `bins` may be one number for both axes, or an (x, y) pair.
+        """
+        xbins, ybins = (bins, bins) if np.isscalar(bins) else bins
+        return cls(_edges(xlim, xbins, xlog), _edges(ylim, ybins, ylog))
+
+    @classmethod
+    def from_points(cls, x, y, bins=100, xlim=None, ylim=None, xlog=False,
+                    ylog=False):
+        """Bin points into a new grid, by default spanning the points' range.
+
+        NaN points are ignored.
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        ok = ~(np.isnan(x) | np.isnan(y))
+        x, y = x[ok], y[ok]
+        if xlim is None:
+            xlim = (x.min(), x.max()) if len(x) else (0, 1)
+        if ylim is None:
+            ylim = (y.min(), y.max()) if len(y) else (0, 1)
+        grid = cls.from_limits(xlim, ylim, bins, xlog, ylog)
+        grid.add(x, y)
+        return grid
+
+    def add(self, x, y):
+        """Add points to the grid, e.g. one sample at a time.
+
+        Points outside the grid's limits are dropped.
+        """
+        counts, _xe, _ye = np.histogram2d(x, y, [self.xedges, self.yedges])
+        self.counts += counts
+        return self
+
+    @property
+    def total(self):
+        return self.counts.sum()
+
+    @property
+    def xcounts(self):
+        """Marginal counts along the x axis."""
+        return self.counts.sum(axis=1)
+
+    @property
+    def ycounts(self):
+        """Marginal counts along the y axis."""
+        return self.counts.sum(axis=0)
+
+    def save(self, fname, key=''):
+        """Save the grid (.npz), with an optional cache key string."""
+        np.savez_compressed(fname, xedges=self.xedges, yedges=self.yedges,
+                            counts=self.counts, key=np.array(key))
+
+    @classmethod
+    def load(cls, fname):
+        """Load a saved grid. Its cache key, if any, is set as `key`."""
+        with np.load(fname) as data:
+            grid = cls(data['xedges'], data['yedges'], data['counts'])
+            grid.key = str(data['key']) if 'key' in data.files else ''
+        return grid
+
+
+def _edges(limits, nbins, log):
+    low, high = limits
+    if log:
+        return np.logspace(np.log10(low), np.log10(high), nbins + 1)
+    return np.linspace(low, high, nbins + 1)
+
+
+def load_or_build(cache_fname, input_fnames, build, params=()):
+    """Load a cached grid if it matches the inputs, else build it.
+
+    The cached grid is used only if it was built from the same set of input
+    files with the same `params` (e.g. the bins and limits), and is newer than
+    all of the inputs. `build` is called with no arguments and must return a
+    DensityGrid; the result is saved to `cache_fname` (if given) for the next
+    run.
+    """
+    key = cache_key(input_fnames, params)
+    if cache_fname and os.path.isfile(cache_fname):
+        cache_mtime = os.stat(cache_fname).st_mtime
+        if all(os.stat(fname).st_mtime <= cache_mtime
+               for fname in input_fnames):
+            grid = DensityGrid.load(cache_fname)
+            if grid.key == key:
+                return grid
+    grid = build()
+    if cache_fname:
+        grid.save(cache_fname, key)
+    return grid
+
+
+def cache_key(input_fnames, params=()):
+    """Digest of the sorted input file paths and the grid parameters."""
+    paths = sorted(os.path.abspath(fname) for fname in input_fnames)
+    return hashlib.sha1(repr((paths, params)).encode('utf-8')).hexdigest()
+
+
+def draw_density(ax, grid, log=True, mincnt=1, cmap=None):
+    """Draw the grid's counts on an axis as one image."""
+    counts = np.ma.masked_less(grid.counts.T, mincnt)
+    norm = (colors.LogNorm(vmin=max(mincnt, 1),
+                           vmax=max(counts.max(), mincnt + 1))
+            if log and counts.count() else None)
+    return ax.pcolormesh(grid.xedges, grid.yedges, counts, norm=norm,
+                         cmap=cmap or "Blues", rasterized=True)
+
+
+def plot_density(grid, log=True, mincnt=1, size=6, space=.03, cmap=None,
+                 hist_kws=None, xscale='linear'):
+    """Joint density image with marginal histograms, like a jointplot.
+
+    Returns the figure and its joint, x-marginal and y-marginal axes.
+    """
+    fig = pyplot.figure(figsize=(size, size))
+    gs = pyplot.GridSpec(6, 6, figure=fig, wspace=space, hspace=space)
+    ax_joint = fig.add_subplot(gs[1:, :-1])
+    ax_marg_x = fig.add_subplot(gs[0, :-1], sharex=ax_joint)
+    ax_marg_y = fig.add_subplot(gs[1:, -1], sharey=ax_joint)
+    for ax in (ax_marg_x, ax_marg_y):
+        pyplot.setp(ax.get_xticklabels() + ax.get_yticklabels(),
+                    visible=False)
+        ax.grid(False)
+    ax_joint.set_xscale(xscale)
+
+    draw_density(ax_joint, grid, log, mincnt, cmap)
+    hist_kws = dict({'histtype': 'stepfilled', 'linewidth': 1},
+                    **(hist_kws or {}))
+    # Marginals come from the same counts, weighting one point per bin
+    ax_marg_x.hist(_centers(grid.xedges, xscale == 'log'), bins=grid.xedges,
+                   weights=grid.xcounts, **hist_kws)
+    ax_marg_y.hist(_centers(grid.yedges, False), bins=grid.yedges,
+                   weights=grid.ycounts, orientation='horizontal', **hist_kws)
+    ax_joint.set_xlim(grid.xedges[0], grid.xedges[-1])
+    ax_joint.set_ylim(grid.yedges[0], grid.yedges[-1])
+    return fig, ax_joint, ax_marg_x, ax_marg_y
+
+
+def _centers(edges, log):
+    if log:
+        return np.sqrt(edges[:-1] * edges[1:])
+    return .5 * (edges[:-1] + edges[1:])
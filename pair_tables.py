@@ -0,0 +1,28 @@
+"""Write paired-segment tables as CSV or as binary record arrays (.npy).
+
+Used by compare/pair_segments.py, cell/compare/pair_segments.py and
+cell/compare/cut_segments.py; scripts in subdirectories add this directory to
+sys.path to import it.
+"""
+from __future__ import division, print_function
+
+import sys
+
+import numpy as np
+
+
+def write_table(table, fname):
+    """Write the paired table as CSV, or as a binary record array (.npy).
+
+    The binary form can be memory-mapped by alt.py and plot_paired_segments.py
+    instead of being re-parsed as text.
+    """
+    if fname and fname.endswith(".npy"):
+        columns = [np.asarray(table[col]) for col in table.columns]
+        # Fixed-width strings, since object arrays can't be memory-mapped
+        np.save(fname, np.rec.fromarrays(
+            [col.astype(str) if col.dtype.kind == 'O' else col
+             for col in columns],
+            names=[str(col) for col in table.columns]))
+    else:
+        table.to_csv(fname or sys.stdout, index=False)
@@ -4,10 +4,11 @@
 from __future__ import division, print_function
 
 import argparse
-from itertools import izip
+import hashlib
 from os.path import basename
 
 import numpy as np
+import pandas as pd
 import seaborn
 from matplotlib import pyplot, cm
 
@@ -18,6 +19,9 @@ from cnvlib.ngfrills import echo
 # from cnvlib.reference import mask_bad_probes
 from cnvlib.smoothing import rolling_median, smoothed
 
+import trendline
+from batch_jobs import imap_jobs
+
 
 seaborn.set(font='Sans', style="ticks")
 
@@ -38,93 +42,148 @@ def load_cna(fname, reference):
     return cnarr
 
 
-def get_bias_func(mode, ref_pset, probes):
+def get_biases(mode, ref_pset, probes):
+    """Calculate the bias value of each probe (bin), as an array."""
     if not ref_pset:
         raise ValueError("Must supply a reference for " + mode)
     ref_matched = fix.match_ref_to_probes(ref_pset, probes)
 
     if mode in ('gc', 'rmask'):
-        return ref_matched[mode]
+        return np.asarray(ref_matched[mode], dtype=float)
     elif mode == 'edge':
-        return fix.make_edge_sorter(ref_matched, params.INSERT_SIZE)
+        return edge_biases(ref_matched, params.INSERT_SIZE)
     else:
         raise ValueError("Unknown mode: %s" % mode)
 
 
-def sort_and_smooth(probes, biases):
-    if callable(biases):
-        biases = map(biases, probes)
-    biases, coverages = zip(*sorted(
-        ((bias, cvg) for bias, cvg in izip(biases, probes['coverage'])),
-        key=lambda bc: bc[0]))
+def edge_biases(tiles, insert_size):
+    """Quantify the "edge effect" of each tile and its neighbors.
+
+    Same as the key of `fix.make_edge_sorter`, i.e. the relative gain in
+    coverage from reads spilling over from neighboring tiles within
+    `insert_size` (gap), minus the loss at the tile's own edges, but
+    calculated for all tiles at once. Tiles are sorted by position within each
+    chromosome, as in .cnn files.
+    """
+    chroms = np.asarray(tiles['chromosome'])
+    starts = np.asarray(tiles['start'])
+    ends = np.asarray(tiles['end'])
+    sizes = (ends - starts).astype(float)
+    # Coverage loss at (both edges of) each tile
+    losses = insert_size / (2 * sizes)
+    small = (sizes < insert_size)
+    losses[small] -= ((insert_size - sizes[small])**2
+                      / (2 * insert_size * sizes[small]))
+    # Coverage gain from the next tile upstream and downstream, if close
+    gaps = np.maximum(starts[1:] - ends[:-1], 0).astype(float)
+    near = (chroms[1:] == chroms[:-1]) & (gaps < insert_size)
+    gaps = gaps[near]
+    gains = np.zeros(len(sizes))
+    gains[1:][near] += _edge_gains(sizes[1:][near], gaps, insert_size)
+    gains[:-1][near] += _edge_gains(sizes[:-1][near], gaps, insert_size)
+    return gains - losses
+
+
+def _edge_gains(sizes, gaps, insert_size):
+    gains = (insert_size - gaps)**2 / (4 * insert_size * sizes)
+    # Neighbors reaching past the other side of the tile gain less
+    past = (sizes + gaps < insert_size)
+    gains[past] -= ((insert_size - sizes[past] - gaps[past])**2
+                    / (4 * insert_size * sizes[past]))
+    return gains
+
+
+def layout_fingerprint(cnarr):
+    """Hash of the bins' coordinates."""
+    row_hashes = pd.util.hash_pandas_object(
+        cnarr.data[['chromosome', 'start', 'end']], index=False)
+    return hashlib.sha1(row_hashes.values.tobytes()).hexdigest()
+
+
+def smooth_sorted(coverages):
+    """Fit a trendline to coverages sorted by bias."""
     # Smooth the biases
     cvg_fitted = rolling_median(coverages, .2)
     # Again! (for aesthetics)
     # cvg_fitted = smoothed(cvg_fitted, .05)
+    return cvg_fitted
 
-    # Print some stats
-    coverages = np.asarray(coverages)
-    orig_var = np.var(coverages)
-    def improvement(fitvals):
-        return 100 * (1 - (np.var(coverages - fitvals) / orig_var))
-
-    # print("Sample \tRaw probes \tTrend line \tReduction")
-    print(probes.sample_id,
-          "\t %.5f    \t %.5f    \t %.4f"
-          % (orig_var, np.var(cvg_fitted), improvement(cvg_fitted)),
-          '%')
-    return biases, coverages, cvg_fitted
 
+def get_sort_and_smoother(ref_arr, mode):
+    """Make a sort_and_smooth func from the reference.
 
-def get_sort_and_smoother(cna_fname, ref_arr, mode):
-    """Make a sort_and_smooth func from example CNA and reference."""
-    ref_matched = fix.match_ref_to_probes(ref_arr, read(cna_fname))
-
-    if mode in ('gc', 'rmask'):
-        biases = ref_matched[mode]
-    elif mode == 'edge':
-        biases = map(fix.make_edge_sorter(ref_matched, params.INSERT_SIZE),
-                     ref_arr)
-    else:
-        raise ValueError("Unknown mode: %s" % mode)
+    The func returns the sample's sorted biases, coverages and trendline, and
+    a summary of the variance explained (see `trendline.summarize`).
 
+    The biases of a sample's bins, and the permutation that sorts them, are
+    calculated for the first sample with each bin layout, and reused for the
+    other samples with the same layout.
+    """
+    layouts = {}
 
     def wrapped_sort_and_smooth(this_arr):
         """Sort and smooth."""
-        assert len(this_arr) == len(biases)
-
-        biases, coverages = zip(*sorted(
-            ((bias, cvg) for bias, cvg in izip(biases, this_arr['coverage'])),
-            key=lambda bc: bc[0]))
-        # Smooth the biases
-        cvg_fitted = rolling_median(coverages, .2)
-        # Again! (for aesthetics)
-        # cvg_fitted = smoothed(cvg_fitted, .05)
-
-        # Print some stats
-        coverages = np.asarray(coverages)
-        orig_var = np.var(coverages)
-        def improvement(fitvals):
-            return 100 * (1 - (np.var(coverages - fitvals) / orig_var))
-
-        # print("Sample \tRaw probes \tTrend line \tReduction")
-        print(this_arr.sample_id,
-            "\t %.5f    \t %.5f    \t %.4f"
-            % (orig_var, np.var(cvg_fitted), improvement(cvg_fitted)))
-        return biases, coverages, cvg_fitted
+        key = layout_fingerprint(this_arr)
+        if key not in layouts:
+            biases = get_biases(mode, ref_arr, this_arr)
+            assert len(this_arr) == len(biases)
+            order = np.argsort(biases, kind='mergesort')
+            layouts[key] = (biases[order], order)
+        biases, order = layouts[key]
+        coverages = np.asarray(this_arr['coverage'])[order]
+        cvg_fitted = smooth_sorted(coverages)
+        summary = trendline.summarize(this_arr.sample_id, mode, coverages,
+                                      cvg_fitted)
+        return biases, coverages, cvg_fitted, summary
 
     return wrapped_sort_and_smooth
 
 
-def plot_separate(filenames, ref_pset, bias_func, mode, do_ratio):
+def _setup_worker(shared):
+    """Per-process state, with its own cache of bin layouts."""
+    ref_pset, mode, do_ratio = shared
+    return ref_pset, do_ratio, get_sort_and_smoother(ref_pset, mode)
+
+
+def _process_job(fname, state):
+    ref_pset, do_ratio, sort_and_smooth = state
+    pset = load_cna(fname, ref_pset if do_ratio else None)
+    return sort_and_smooth(pset)
+
+
+def process_samples(filenames, ref_pset, mode, do_ratio, processes=1,
+                    summaries=None):
+    """Load each sample, sort its bins by bias and fit a trendline.
+
+    With `processes` other than 1, samples are processed in a pool of worker
+    processes (`None` for one per CPU). Each worker calculates the biases of
+    each bin layout once (see `get_sort_and_smoother`).
+
+    Yields: (biases, coverages, fitted trendline) arrays for each sample, in
+    the order of `filenames`, after printing the variance explained by the
+    trendline. Each sample's summary is also appended to `summaries`, if given.
+    """
+    results = imap_jobs(_process_job, filenames, processes,
+                        shared=(ref_pset, mode, do_ratio),
+                        setup=_setup_worker)
+    for biases, coverages, fitted, summary in results:
+        print(summary['sample'],
+              "\t %.5f    \t %.5f    \t %.4f"
+              % (summary['var_raw'], summary['var_trend'],
+                 summary['pct_explained']),
+              '%')
+        if summaries is not None:
+            summaries.append(summary)
+        yield biases, coverages, fitted
+
+
+def plot_separate(filenames, results, mode, do_ratio):
     """Plot coverages versus other factors to reveal systematic biases."""
     _fig, axes = pyplot.subplots(len(filenames), squeeze=False, sharex=True,
                                  figsize=(4, 4))
 
-    for fname, ax in zip(filenames, axes[:, 0]):
-        # Compute points to plot
-        pset = load_cna(fname, ref_pset if do_ratio else None)
-        bias, coverages, fitted = sort_and_smooth(pset, bias_func)
+    for fname, ax, (bias, coverages, fitted) in zip(filenames, axes[:, 0],
+                                                    results):
         ax.plot(bias, fitted, color='#F04040', alpha=0.7, lw=2, zorder=-.1)
         ax.scatter(bias, coverages, marker='.', color='#666666', zorder=-1, alpha=0.1)
         # Aesthetics
@@ -141,16 +200,13 @@ def plot_separate(filenames, ref_pset, bias_func, mode, do_ratio):
     pyplot.xlabel(mode)
 
 
-def plot_overlaid(filenames, ref_pset, bias_func, mode, do_ratio, colorscheme):
+def plot_overlaid(filenames, results, mode, do_ratio, colorscheme):
     """Plot coverages versus other factors to reveal systematic biases."""
     _fig, ax = pyplot.subplots(figsize=(4, 4))
     ax.tick_params(labelsize='large')
 
     colors = map(getattr(cm, colorscheme), np.arange(.1, .9, .8/len(filenames)))
-    for fname, color in zip(filenames, colors):
-        # Compute points to plot
-        pset = load_cna(fname, ref_pset if do_ratio else None)
-        bias, _coverages, fitted = sort_and_smooth(pset, bias_func)
+    for color, (bias, _coverages, fitted) in zip(colors, results):
         ax.plot(bias, fitted, color=color, alpha=0.7, lw=2, zorder=-.1)
 
     # Aesthetics
@@ -168,13 +224,19 @@ def main(args):
     """*"""
     do_ratio = bool(args.reference)
     ref_pset = read(args.reference or args.no_reference)
-    bias_func = get_bias_func(args.mode, ref_pset, read(args.filenames[0]))
+    if not ref_pset:
+        raise ValueError("Must supply a reference for " + args.mode)
+    summaries = []
+    results = process_samples(args.filenames, ref_pset, args.mode, do_ratio,
+                              args.processes or None, summaries)
 
     print("Sample \tRaw probes \tTrend line \tReduction (%)")
     if args.batch:
-        plot_overlaid(args.filenames, ref_pset, bias_func, args.mode, do_ratio, args.color)
+        plot_overlaid(args.filenames, results, args.mode, do_ratio, args.color)
     else:
-        plot_separate(args.filenames, ref_pset, bias_func, args.mode, do_ratio)
+        plot_separate(args.filenames, results, args.mode, do_ratio)
+    if args.summary:
+        trendline.write_summary(summaries, args.summary)
 
     if args.output:
         pyplot.savefig(args.output, format='pdf', bbox_inches=0)
@@ -201,5 +263,11 @@ if __name__ == '__main__':
     AP.add_argument('-nr', '--no-reference',
                     help="""Reference coverage table for GC, but NOT to compute
                     CN ratios -- show raw copy numbers).""")
+    AP.add_argument('-p', '--processes', type=int, default=1,
+                    help="""Number of worker processes for loading samples
+                    (0 for all CPUs) [%(default)s].""")
     AP.add_argument("-o", "--output", help="Output PDF file name")
+    AP.add_argument("-s", "--summary",
+                    help="""Output table (TSV) of the variance explained by the
+                    trendline in each sample.""")
     main(AP.parse_args())
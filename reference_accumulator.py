@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+"""Pooled copy number reference, kept as per-bin statistics of the normals.
+
+Instead of rebuilding a reference from all normal samples whenever one of them
+changes, keep a store (.npz) of per-bin sums, sums of squares and histograms
+of the normals' median-centered log2 coverages. Adding or removing a normal
+then updates the statistics in O(bins); each normal's values are kept too, in
+a buffer with room to grow, so that they are not copied either (save and load
+still read and write the whole store). A reference built from the store gives
+each bin's median (interpolated from its histogram) as log2, and the standard
+deviation as spread. The reference that leaves out any one normal -- for QC of
+that normal against the others -- is built by subtracting its values instead
+of starting over.
+
+Normals are given as *.targetcoverage.cnn files; the *.antitargetcoverage.cnn
+files are taken from the same directories. Target and antitarget bins are each
+centered at the median of their autosomes, then combined and sorted. As with
+'cnvkit.py reference -y', the sex chromosomes are put at one copy: a normal
+that looks female has chrX shifted down by 1, and chrY, which is only noise
+there, set to -1. If a template reference is given (e.g. from 'cnvkit.py
+reference'), its bin order and GC and RepeatMasker columns are used in the
+output.
+
+This approximates 'cnvkit.py reference' without bias corrections, which is
+enough to compare normals with each other, and is not meant to replace it.
+
+Usage::
+
+    reference_accumulator.py add build/tr-normals.npz \
+        targeted/TR_*_N.targetcoverage.cnn
+    reference_accumulator.py remove build/tr-normals.npz TR_01_N
+    reference_accumulator.py build build/tr-normals.npz -o ref.cnn [-x TR_01_N]
+    reference_accumulator.py loo build/tr-normals.npz -d build/tr-loo/
+"""
+from __future__ import absolute_import, division, print_function
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+import cnvlib
+
+# Histogram of each bin's log2 values, for the median; values beyond the range
+# are counted in the first or last cell
+HIST_RANGE = (-5., 5.)
+HIST_CELLS = 320
+
+
+class ReferenceAccumulator(object):
+    """Per-bin statistics of a set of normal samples' log2 coverages."""
+
+    def __init__(self, bins, samples=(), mtimes=(), values=None):
+        self.bins = bins
+        self.samples = list(samples)
+        self.mtimes = list(mtimes)
+        n_bins = len(bins)
+        if values is None:
+            values = np.empty((0, n_bins), dtype=np.float32)
+        # Rows beyond len(samples) are spare capacity
+        self._buffer = values
+        self.total = values.sum(axis=0, dtype=np.float64)
+        self.total_sq = np.square(values, dtype=np.float64).sum(axis=0)
+        self.hist = np.zeros((n_bins, HIST_CELLS), dtype=np.uint16)
+        for row in values:
+            self._count(row)
+
+    @classmethod
+    def load(cls, fname):
+        with np.load(fname) as npz:
+            bins = pd.DataFrame({'chromosome': npz['chromosome'],
+                                 'start': npz['start'],
+                                 'end': npz['end'],
+                                 'gene': npz['gene']},
+                                columns=['chromosome', 'start', 'end',
+                                         'gene'])
+            acc = cls.__new__(cls)
+            acc.bins = bins
+            acc.samples = list(npz['samples'])
+            acc.mtimes = list(npz['mtimes'])
+            acc._buffer = npz['values']
+            acc.total = npz['total']
+            acc.total_sq = npz['total_sq']
+            acc.hist = npz['hist']
+        return acc
+
+    def save(self, fname):
+        tmp_fname = "%s.%d.tmp.npz" % (fname[:-4], os.getpid())
+        np.savez(tmp_fname,
+                 chromosome=np.asarray(self.bins['chromosome'], dtype=str),
+                 start=self.bins['start'].values,
+                 end=self.bins['end'].values,
+                 gene=np.asarray(self.bins['gene'], dtype=str),
+                 samples=np.asarray(self.samples, dtype=str),
+                 mtimes=np.asarray(self.mtimes, dtype=float),
+                 values=self.values, total=self.total,
+                 total_sq=self.total_sq, hist=self.hist)
+        os.rename(tmp_fname, fname)
+        print("Wrote", fname, "with", len(self.samples), "samples",
+              file=sys.stderr)
+
+    @property
+    def values(self):
+        """Matrix of the samples' log2 values, one row per sample."""
+        return self._buffer[:len(self.samples)]
+
+    def add(self, sample, log2, mtime=0.):
+        """Add (or replace) one normal sample's log2 values."""
+        if sample in self.samples:
+            self.remove(sample)
+        log2 = np.asarray(log2, dtype=np.float32)
+        assert len(log2) == len(self.bins)
+        n = len(self.samples)
+        if n == len(self._buffer):
+            # Grow by doubling, so rows are copied O(1) times on average
+            buffer = np.empty((max(2 * n, 8), len(self.bins)),
+                              dtype=np.float32)
+            buffer[:n] = self._buffer[:n]
+            self._buffer = buffer
+        self._buffer[n] = log2
+        self.samples.append(sample)
+        self.mtimes.append(mtime)
+        self.total += log2
+        self.total_sq += np.square(log2, dtype=np.float64)
+        self._count(log2)
+
+    def remove(self, sample):
+        """Remove one normal sample's log2 values.
+
+        The last sample is moved into its place, so the order of the samples
+        changes.
+        """
+        idx = self.samples.index(sample)
+        log2 = self._buffer[idx]
+        self.total -= log2
+        self.total_sq -= np.square(log2, dtype=np.float64)
+        self._uncount(log2)
+        last = len(self.samples) - 1
+        self._buffer[idx] = self._buffer[last]
+        self.samples[idx] = self.samples[last]
+        self.mtimes[idx] = self.mtimes[last]
+        del self.samples[last]
+        del self.mtimes[last]
+
+    def _count(self, log2):
+        self.hist[np.arange(len(log2)), _hist_cells(log2)] += 1
+
+    def _uncount(self, log2):
+        self.hist[np.arange(len(log2)), _hist_cells(log2)] -= 1
+
+    def reference(self, leave_out=None):
+        """Reference log2 (median) and spread (SD) of each bin.
+
+        With `leave_out`, the named sample's values are excluded.
+
+        Returns a DataFrame of the bins with the columns 'log2' and 'spread'.
+        """
+        n = len(self.samples)
+        total = self.total
+        total_sq = self.total_sq
+        if leave_out is not None:
+            log2 = self.values[self.samples.index(leave_out)]
+            n -= 1
+            total = total - log2
+            total_sq = total_sq - np.square(log2, dtype=np.float64)
+        if n < 1:
+            raise ValueError("No samples left in the reference")
+        mean = total / n
+        variance = np.maximum(total_sq / n - mean ** 2, 0)
+        if leave_out is None:
+            medians = hist_median(self.hist, n)
+        else:
+            # Take the sample out of the histograms, then put it back
+            self._uncount(log2)
+            try:
+                medians = hist_median(self.hist, n)
+            finally:
+                self._count(log2)
+        return self.bins.assign(log2=medians, spread=np.sqrt(variance))
+
+
+def _hist_cells(log2):
+    lo, hi = HIST_RANGE
+    cells = np.floor((log2 - lo) * HIST_CELLS / (hi - lo)).astype(np.int64)
+    return np.clip(cells, 0, HIST_CELLS - 1)
+
+
+def hist_median(hist, n):
+    """Median of each row's values, interpolated within histogram cells."""
+    lo, hi = HIST_RANGE
+    cell_width = (hi - lo) / HIST_CELLS
+    cum = np.cumsum(hist, axis=1, dtype=np.int64)
+    half = n / 2
+    cell = np.minimum((cum < half).sum(axis=1), HIST_CELLS - 1)
+    rows = np.arange(len(hist))
+    below = cum[rows, cell] - hist[rows, cell]
+    in_cell = np.maximum(hist[rows, cell], 1)
+    return lo + cell_width * (cell + (half - below) / in_cell)
+
+
+def sample_name(target_fname):
+    base = os.path.basename(target_fname)
+    assert base.endswith(".targetcoverage.cnn"), base
+    return base[:-len(".targetcoverage.cnn")]
+
+
+def load_normal(target_fname, template=None):
+    """Read a normal sample's target and antitarget coverages.
+
+    Returns the median-centered log2 values, with the sex chromosomes shifted
+    as for a male reference, in the order of `template` (a DataFrame of bins)
+    if given, otherwise sorted by position, and the bins.
+    """
+    antitarget_fname = os.path.join(
+        os.path.dirname(target_fname),
+        sample_name(target_fname) + ".antitargetcoverage.cnn")
+    parts = []
+    for fname in (target_fname, antitarget_fname):
+        cnarr = cnvlib.read(fname)
+        cnarr['log2'] -= np.median(cnarr.autosomes()['log2'])
+        parts.append(cnarr.data)
+    cnarr = cnarr.as_dataframe(pd.concat(parts, ignore_index=True))
+    cnarr.sort()
+    data = shift_sex_chroms(cnarr).reset_index(drop=True)
+    if template is not None:
+        data = align_bins(data, template, target_fname)
+    return data['log2'].values, data[['chromosome', 'start', 'end', 'gene']]
+
+
+def shift_sex_chroms(cnarr):
+    """Put the sex chromosomes at one copy, as in a male reference.
+
+    Log2 values centered on the autosomes have chrX at 0 in females and -1 in
+    males. Females' chrX is shifted down to match, and their chrY set to -1, as
+    in 'cnvkit.py reference -y'. Returns the data as a DataFrame.
+    """
+    data = cnarr.data.copy()
+    if cnarr.guess_xx(False):
+        is_x = data['chromosome'].isin(['chrX', 'X']).values
+        is_y = data['chromosome'].isin(['chrY', 'Y']).values
+        data.loc[is_x, 'log2'] -= 1.0
+        data.loc[is_y, 'log2'] = -1.0
+    return data
+
+
+def align_bins(data, bins, fname):
+    """Reorder `data` rows to match `bins`, by coordinates.
+
+    Columns of `bins` other than the coordinates are kept, and replace those of
+    `data`.
+    """
+    keys = ['chromosome', 'start', 'end']
+    data = data.drop([col for col in bins.columns
+                      if col in data.columns and col not in keys], axis=1)
+    merged = bins.merge(data, on=keys, how='left')
+    if len(merged) != len(bins) or merged['log2'].isnull().any():
+        raise ValueError("Bins in %s differ from the reference's" % fname)
+    return merged
+
+
+def read_template(fname):
+    template = cnvlib.read(fname).data.reset_index(drop=True)
+    return template[[col for col in ('chromosome', 'start', 'end', 'gene',
+                                     'gc', 'rmask')
+                     if col in template]]
+
+
+def write_reference(table, template, fname):
+    """Write the reference as .cnn, with GC and RepeatMasker values if given.
+
+    With a template, its bins and their order are used.
+    """
+    columns = ['chromosome', 'start', 'end', 'gene', 'log2']
+    if template is not None:
+        keys = ['chromosome', 'start', 'end']
+        extra = [col for col in ('gc', 'rmask') if col in template]
+        table = align_bins(table.drop('gene', axis=1),
+                           template[keys + ['gene'] + extra], fname)
+        columns += extra
+    out = pd.DataFrame(table, columns=columns + ['spread'])
+    out.to_csv(fname, sep='\t', index=False, float_format='%.6g')
+    print("Wrote", fname, file=sys.stderr)
+
+
+def cmd_add(args):
+    acc = (ReferenceAccumulator.load(args.store)
+           if os.path.isfile(args.store) else None)
+    # New samples' bins are put in the order of the store, or the template
+    if acc is not None:
+        template = acc.bins
+    elif args.template:
+        template = read_template(args.template)
+    else:
+        template = None
+    n_added = 0
+    for fname in args.target_fnames:
+        sample = sample_name(fname)
+        mtime = max(os.path.getmtime(fname),
+                    os.path.getmtime(fname.replace(".targetcoverage.cnn",
+                                                   ".antitargetcoverage.cnn")))
+        if (acc is not None and sample in acc.samples
+                and acc.mtimes[acc.samples.index(sample)] >= mtime):
+            continue
+        log2, bins = load_normal(fname, template)
+        if acc is None:
+            acc = ReferenceAccumulator(bins)
+        acc.add(sample, log2, mtime)
+        n_added += 1
+        print("Added", sample, file=sys.stderr)
+    if args.sync and acc is not None:
+        keep = set(sample_name(fname) for fname in args.target_fnames)
+        for sample in [sample for sample in acc.samples if sample not in keep]:
+            acc.remove(sample)
+            n_added += 1
+            print("Removed", sample, file=sys.stderr)
+    if n_added:
+        acc.save(args.store)
+    elif os.path.isfile(args.store):
+        # Nothing changed, but mark the store as up to date (e.g. for make)
+        os.utime(args.store, None)
+
+
+def cmd_remove(args):
+    acc = ReferenceAccumulator.load(args.store)
+    for sample in args.samples:
+        acc.remove(sample)
+        print("Removed", sample, file=sys.stderr)
+    acc.save(args.store)
+
+
+def cmd_build(args):
+    template = read_template(args.template) if args.template else None
+    acc = ReferenceAccumulator.load(args.store)
+    write_reference(acc.reference(args.leave_out), template, args.output)
+
+
+def cmd_loo(args):
+    template = read_template(args.template) if args.template else None
+    acc = ReferenceAccumulator.load(args.store)
+    for sample in acc.samples:
+        write_reference(acc.reference(sample), template,
+                        os.path.join(args.output_dir,
+                                     sample + ".loo-reference.cnn"))
+
+
+if __name__ == '__main__':
+    AP = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    AP_sub = AP.add_subparsers()
+
+    P = AP_sub.add_parser('add', help="Add or update normal samples.")
+    P.add_argument('store', help="Accumulator file (.npz).")
+    P.add_argument('target_fnames', nargs='+',
+                   help="Normal samples' *.targetcoverage.cnn files.")
+    P.add_argument('-t', '--template',
+                   help="""Reference .cnn whose bin order to use. Only needed
+                   when creating the store.""")
+    P.add_argument('-s', '--sync', action='store_true',
+                   help="""Also remove stored samples that are not among the
+                   given files.""")
+    P.set_defaults(func=cmd_add)
+
+    P = AP_sub.add_parser('remove', help="Remove normal samples.")
+    P.add_argument('store', help="Accumulator file (.npz).")
+    P.add_argument('samples', nargs='+', help="Sample names, e.g. TR_01_N.")
+    P.set_defaults(func=cmd_remove)
+
+    P = AP_sub.add_parser('build', help="Write a reference .cnn.")
+    P.add_argument('store', help="Accumulator file (.npz).")
+    P.add_argument('-x', '--leave-out', metavar='SAMPLE',
+                   help="Sample to exclude from the reference.")
+    P.add_argument('-t', '--template',
+                   help="""Reference .cnn to take GC and RepeatMasker values
+                   from.""")
+    P.add_argument('-o', '--output', required=True,
+                   help="Output reference (.cnn).")
+    P.set_defaults(func=cmd_build)
+
+    P = AP_sub.add_parser('loo',
+                          help="Write each sample's leave-one-out reference.")
+    P.add_argument('store', help="Accumulator file (.npz).")
+    P.add_argument('-t', '--template',
+                   help="""Reference .cnn to take GC and RepeatMasker values
+                   from.""")
+    P.add_argument('-d', '--output-dir', default='.',
+                   help="""Output directory, for <sample>.loo-reference.cnn
+                   files.""")
+    P.set_defaults(func=cmd_loo)
+
+    args = AP.parse_args()
+    args.func(args)
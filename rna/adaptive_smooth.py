@@ -0,0 +1,68 @@
+"""Weighted moving average with a window that adapts to the local weights.
+
+Each bin's window is the narrowest one, centered on that bin, whose bins' total
+weight reaches that of a nominal-width window of average weight. So the window
+shrinks where the bins are well supported and grows where they are not. If
+read depths are given, each bin's weight is also scaled by how deeply it is
+covered, ``depth / (depth + median depth)``, when setting the window widths,
+since log2 ratios of lowly expressed genes are noisier (see
+plot_depth_vs_logr.py). At the ends of the signal the window is truncated, and
+widens inward until it reaches the same total weight.
+
+Window widths are found by a bisection on cumulative sums of the weights,
+simultaneously for all bins, so the cost is O(n log n). Arrays may be 1-D (one
+sample) or 2-D (samples x bins); smoothing is along the last axis.
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+
+def adaptive_weighted_average(x, w, window_size, depth=None):
+    """Weighted average of `x` over windows of adaptive width.
+
+    The target total weight of each window is `window_size` times the mean of
+    `w`, or with `depth`, of the depth-scaled weights. Within each window, the
+    values of `x` are averaged with weights `w`.
+
+    Returns an array of the same shape as `x`.
+    """
+    n_bins = x.shape[-1]
+    # Bins with a NaN value or weight get no weight
+    ok = ~(np.isnan(x) | np.isnan(w))
+    w = np.where(ok, w, 0.)
+    cum_w = _cumsum0(w)
+    cum_wx = _cumsum0(np.where(ok, x, 0.) * w)
+    if depth is None:
+        cum_info = cum_w
+    else:
+        mid_depth = np.median(depth, axis=-1, keepdims=True)
+        cum_info = _cumsum0(w * depth / np.maximum(depth + mid_depth, 1e-9))
+    target = window_size * cum_info[..., -1:] / n_bins
+    idx = np.broadcast_to(np.arange(n_bins), x.shape)
+
+    def bounds(wing):
+        return np.maximum(idx - wing, 0), np.minimum(idx + wing + 1, n_bins)
+
+    def window_sum(cum, wing):
+        starts, ends = bounds(wing)
+        return (np.take_along_axis(cum, ends, axis=-1)
+                - np.take_along_axis(cum, starts, axis=-1))
+
+    # Smallest wing in [0, n_bins] with enough total weight, per bin
+    lo = np.zeros(x.shape, dtype=np.int64)
+    hi = np.full(x.shape, n_bins, dtype=np.int64)
+    while (lo < hi).any():
+        mid = (lo + hi) // 2
+        enough = window_sum(cum_info, mid) >= target
+        hi = np.where(enough, mid, hi)
+        lo = np.where(enough, lo, mid + 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return window_sum(cum_wx, lo) / window_sum(cum_w, lo)
+
+
+def _cumsum0(a):
+    """Cumulative sum along the last axis, starting with 0."""
+    out = np.zeros(a.shape[:-1] + (a.shape[-1] + 1,), dtype=np.float64)
+    np.cumsum(a, axis=-1, out=out[..., 1:])
+    return out
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""Time each smoothing method on a cohort of identically binned .cnr files.
+
+Each method is applied in cohort mode (see cohort_smooth.py), and also sample
+by sample, arm by arm, with the per-file code of smooth_tirosh.py (tsmooth) or
+smooth_cnr.py (the others), at each window size. Both include making the
+smoothed copy of each sample's .cnr, but not reading or writing files. Output
+is a table of the best of several runs' wall-clock times, in seconds.
+"""
+from __future__ import absolute_import, division, print_function
+import argparse
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+import cohort_smooth
+import smooth_cnr
+import smooth_tirosh
+
+METHODS = ('tsmooth', 'boxcar', 'kaiser', 'hann', 'adaptive')
+
+
+def cohort_smoother(method, cnarrs, log2, weights, bounds, depths, window):
+    if method == 'tsmooth':
+        smooth = lambda: cohort_smooth.clipped_rolling_mean(log2, bounds,
+                                                            window)
+    else:
+        smooth = lambda: cohort_smooth.clipped_weighted_smooth(
+            log2, weights, bounds, window, method,
+            depths if method == 'adaptive' else None)
+    return lambda: [cohort_smooth.with_log2(cnr, logr)
+                    for cnr, logr in zip(cnarrs, smooth())]
+
+
+def sample_smoother(method, cnarrs, window):
+    if method == 'tsmooth':
+        return lambda: [smooth_tirosh.smooth_by_arm(cnr, window)
+                        for cnr in cnarrs]
+    return lambda: [smooth_cnr.smooth_by_arm(cnr, [window], method)
+                    for cnr in cnarrs]
+
+
+AP = argparse.ArgumentParser(description=__doc__)
+AP.add_argument('cnr_fnames', nargs='+')
+AP.add_argument('-w', '--window', type=int, nargs='+', default=[50, 100, 400],
+                help="Window sizes to time.")
+AP.add_argument('-m', '--method', nargs='+', choices=METHODS, default=METHODS,
+                help="Smoothing methods to time.")
+AP.add_argument('-r', '--repeat', type=int, default=3,
+                help="Number of runs of each timing. [Default: %(default)s]")
+AP.add_argument('-o', '--output', default=sys.stdout,
+                help="Output table (TSV).")
+args = AP.parse_args()
+
+cnarrs, log2, weights, bounds = cohort_smooth.load_cohort(args.cnr_fnames)
+depths = (np.vstack([cnr['depth'].values for cnr in cnarrs])
+          if 'depth' in cnarrs[0] else None)
+print("Loaded", len(cnarrs), "samples x", log2.shape[1], "bins",
+      file=sys.stderr)
+
+rows = []
+for method in args.method:
+    for window in args.window:
+        cohort = cohort_smoother(method, cnarrs, log2, weights, bounds,
+                                 depths, window)
+        samples = sample_smoother(method, cnarrs, window)
+        t_cohort = min(timeit.repeat(cohort, number=1, repeat=args.repeat))
+        t_samples = min(timeit.repeat(samples, number=1, repeat=args.repeat))
+        rows.append((method, window, t_cohort, t_samples))
+        print(method, window, "cohort: %.3fs," % t_cohort,
+              "per sample: %.3fs" % t_samples, file=sys.stderr)
+
+table = pd.DataFrame.from_records(
+    rows, columns=['method', 'window', 'cohort_sec', 'per_sample_sec'])
+table.to_csv(args.output, sep='\t', index=False, float_format='%.4f')
@@ -0,0 +1,121 @@
+"""Smooth the log2 ratios of a whole cohort of identically binned .cnr files.
+
+The samples' log2 ratios and weights are stacked into samples x bins
+matrices, the chromosome arm boundaries are found once, and each smoother is
+applied along the bins axis for all samples at once. Results are the same as
+smoothing each sample's arms separately with smooth_tirosh.py (clipped
+rolling mean) or smooth_cnr.py (clipped weighted boxcar, Kaiser, Hann or
+adaptive).
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+import cnvlib
+from cnvlib import smoothing
+
+import adaptive_smooth
+import window_smooth
+
+
+def load_cohort(fnames):
+    """Read .cnr files that share the same bins.
+
+    Returns: the CopyNumArray of each sample; the samples x bins matrices of
+    log2 ratios and of weights; and the bin offsets where each chromosome
+    arm starts, followed by the total number of bins.
+    """
+    cnarrs = [cnvlib.read(fname) for fname in fnames]
+    first = cnarrs[0]
+    for fname, cnarr in zip(fnames[1:], cnarrs[1:]):
+        if not (len(cnarr) == len(first)
+                and (cnarr.chromosome.values == first.chromosome.values).all()
+                and (cnarr.start.values == first.start.values).all()
+                and (cnarr.end.values == first.end.values).all()):
+            raise ValueError("Bins in %s differ from those in %s"
+                             % (fname, fnames[0]))
+    log2 = np.vstack([cnarr['log2'].values for cnarr in cnarrs])
+    weights = np.vstack([cnarr['weight'].values for cnarr in cnarrs])
+    bounds = np.cumsum([0] + [len(cnarm) for _chrom, cnarm in first.by_arm()])
+    assert bounds[-1] == len(first)
+    return cnarrs, log2, weights, bounds
+
+
+def by_arm(matrix, bounds):
+    """Split a samples x bins matrix into column blocks, one per arm."""
+    return [matrix[:, start:end]
+            for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def clipped_rolling_mean(log2, bounds, window):
+    """Unweighted boxcar, with the signal windsorized at +/- 3.
+
+    Matches pandas' ``rolling(window, min_periods=1, center=True).mean()``
+    within each arm: windows are truncated at the arm ends, and NaNs are
+    skipped.
+    """
+    chunks = []
+    for x in by_arm(log2.clip(-3, 3), bounds):
+        n_bins = x.shape[1]
+        ok = ~np.isnan(x)
+        cum_x = _cumsum0(np.where(ok, x, 0.))
+        cum_n = _cumsum0(ok.astype(np.int64))
+        ends = np.arange(n_bins) + (window - 1) // 2 + 1
+        starts = np.maximum(ends - window, 0)
+        ends = np.minimum(ends, n_bins)
+        with np.errstate(invalid='ignore'):
+            chunks.append((cum_x[:, ends] - cum_x[:, starts])
+                          / (cum_n[:, ends] - cum_n[:, starts]))
+    return np.hstack(chunks)
+
+
+def clipped_weighted_smooth(log2, weights, bounds, window, method='boxcar',
+                            depths=None):
+    """Weighted moving average, with the signal windsorized at +/- 3.
+
+    Within each arm, the window size is set as in `smoothing._width2wing` and
+    the ends are padded with a mirror image of the nearest `wing` bins, as in
+    smooth_cnr.py. The boxcar average uses cumulative sums; other window
+    shapes are convolved by `window_smooth.weighted_smooth`, and the
+    'adaptive' method uses `adaptive_smooth.adaptive_weighted_average`, with
+    the samples x bins read `depths` if given.
+    """
+    chunks = []
+    depth_arms = (by_arm(depths, bounds) if depths is not None
+                  else [None] * (len(bounds) - 1))
+    for x, w, depth in zip(by_arm(log2.clip(-3, 3), bounds),
+                           by_arm(weights, bounds), depth_arms):
+        wing = smoothing._width2wing(window, x[0])
+        if method == 'adaptive':
+            chunks.append(adaptive_smooth.adaptive_weighted_average(
+                x, w, 2 * wing + 1, depth))
+            continue
+        if method != 'boxcar':
+            chunks.append(window_smooth.weighted_smooth(x, w, wing, method))
+            continue
+        width = 2 * wing + 1
+        xp = window_smooth.mirror_pad(x, wing)
+        wp = window_smooth.mirror_pad(w, wing)
+        # Skip NaNs, as in smooth_cnr.rolling_weighted_average
+        ok = ~(np.isnan(xp) | np.isnan(wp))
+        cum_wx = _cumsum0(np.where(ok, xp * wp, 0.))
+        cum_w = _cumsum0(np.where(ok, wp, 0.))
+        cum_n = _cumsum0(ok.astype(np.int64))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            avg = ((cum_wx[:, width:] - cum_wx[:, :-width])
+                   / (cum_w[:, width:] - cum_w[:, :-width]))
+        avg[cum_n[:, width:] == cum_n[:, :-width]] = np.nan
+        chunks.append(avg)
+    return np.hstack(chunks)
+
+
+def _cumsum0(a):
+    """Cumulative sum along each row, starting with a column of zeros."""
+    out = np.zeros((a.shape[0], a.shape[1] + 1), dtype=a.dtype)
+    np.cumsum(a, axis=1, out=out[:, 1:])
+    return out
+
+
+def with_log2(cnarr, log2):
+    """Copy of `cnarr` with its log2 ratios replaced."""
+    return cnarr.as_dataframe(cnarr.data.assign(log2=log2))
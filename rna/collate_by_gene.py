@@ -2,17 +2,26 @@
 """Load .cnr or .cns files into a table of genes vs. sample log2 ratios.
 
 Output that combined table as TSV.
+
+With --cache, each sample's values are kept in a cache directory and reused
+while the input file (and gene resource and options) are unchanged, so adding
+a sample to a cohort only loads that sample.
 """
 from __future__ import absolute_import, division, print_function
 
+import hashlib
 import os
 import sys
 
+import numpy as np
 import pandas as pd
 
 import cnvlib
 from cnvlib.rna import load_gene_info
-from skgenome.intersect import by_shared_chroms
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+from batch_jobs import imap_jobs
 
 
 def basename(path):
@@ -20,12 +29,60 @@ def basename(path):
     return fname.split('.', 1)[0]
 
 
-def load_cnx(fname, gene_info, min_weight=0, is_segment=False):
+def load_cnx(fname, gene_index, min_weight=0):
     """Load .cnr or .cns file, extract 'log2' and 'gene' columns.
 
-    With `is_segment`, unpack genes in each segment of the input .cns file.
+    Genes are located by their midpoints in the bins or segments of the input
+    file; with a .cns file, all genes in each segment are unpacked. Files with
+    the same layout of bins and genes, e.g. all .cnr files from
+    import-rna, reuse the same gene-to-bin lookup (see `locate_genes`).
+
+    Returns: the sample name, then the log2 ratios (float32), containing-bin
+    or segment sizes (int32) and a mask of genes found in this sample, each a
+    vector aligned to the gene order of `gene_index`. Genes not found in the
+    sample are NaN in log2 and 0 in size.
+    """
+    d = cnvlib.read(fname).autosomes().data
+    if min_weight:
+        ok_wt = d['weight'] >= min_weight
+        d = d[ok_wt]
+        print("Dropped", (~ok_wt).sum(), "rows with weight below", min_weight)
+
+    key = layout_fingerprint(d)
+    if key not in _LAYOUTS:
+        _LAYOUTS[key] = locate_genes(d, gene_index, fname)
+    codes, rows = _LAYOUTS[key]
+
+    n_genes = len(gene_index[0])
+    log2 = np.full(n_genes, np.nan, dtype=np.float32)
+    log2[codes] = d['log2'].values.take(rows)
+    sizes = np.zeros(n_genes, dtype=np.int32)
+    sizes[codes] = (d['end'].values - d['start'].values).take(rows)
+    found = np.zeros(n_genes, dtype=bool)
+    found[codes] = True
+    return basename(fname), log2, sizes, found
+
+
+# Gene-to-bin lookups already calculated in this process, by layout
+_LAYOUTS = {}
+
+
+def layout_fingerprint(d):
+    """Hash of the bins' (or segments') coordinates and gene names."""
+    row_hashes = pd.util.hash_pandas_object(
+        d[['chromosome', 'start', 'end', 'gene']], index=False)
+    return hashlib.sha1(row_hashes.values.tobytes()).hexdigest()
+
 
-    Returns: Series of log2 ratios indexed by gene names.
+def locate_genes(d, gene_index, fname):
+    """Find the bin or segment containing each gene's midpoint.
+
+    Genes that aren't listed in the bins' (or segments') gene names, and
+    genes whose names occur more than once among the located genes, are
+    skipped.
+
+    Returns: arrays of the located genes' numbers in `gene_index`, and the
+    positions of the corresponding rows in `d`.
 
     Example
     -------
@@ -49,56 +106,56 @@ def load_cnx(fname, gene_info, min_weight=0, is_segment=False):
                  X  X                    X              X   <-gaps
 
     """
-    d = cnvlib.read(fname).autosomes().data
-    if min_weight:
-        ok_wt = d['weight'] >= min_weight
-        d = d[ok_wt]
-        print("Dropped", (~ok_wt).sum(), "rows with weight below", min_weight)
-
+    gene_names, chrom_genes = gene_index
     # Drop genes that aren't also listed in the .cnr/.cns file?
     print("Filtering out bad gene names from gene_info")
     if 'probes' in d.columns:
         # It's segments -- multiple genes
-        ok_gene_names = set()
-        for x in d['gene'].str.split(','):
-            ok_gene_names.update(x)
+        ok_gene_names = d['gene'].str.split(',').explode().unique()
     else:
-        ok_gene_names = d['gene']
-    mask_to_keep = gene_info['gene'].isin(ok_gene_names)
-    print("Keeping", mask_to_keep.sum(), "/", len(mask_to_keep),
-          "gene names in gene_info")
-    gene_info = gene_info[mask_to_keep]
-
-    chunks = []
-    for _chrom, info_rows, cnx_rows in by_shared_chroms(gene_info, d, False):
-        info_midpoints = info_rows['midpoint'].values
-        info_genes = info_rows['gene'].values
+        ok_gene_names = d['gene'].values
+    ok_codes = np.isin(gene_names, np.asarray(ok_gene_names, dtype=str))
+
+    chroms = d['chromosome'].values
+    all_starts = d['start'].values
+    all_ends = d['end'].values
+    codes_chunks = []
+    rows_chunks = []
+    n_kept = n_info = 0
+    for chrom in pd.unique(chroms):
+        if chrom not in chrom_genes:
+            continue
+        info_midpoints, info_codes = chrom_genes[chrom]
+        n_info += len(info_codes)
+        keep = ok_codes[info_codes]
+        info_midpoints = info_midpoints[keep]
+        info_codes = info_codes[keep]
+        n_kept += len(info_codes)
+        cnx_rows = (chroms == chrom).nonzero()[0]
         # Locate which segments/bins each gene midpoint falls within
         # - Compare both start and end to ensure (start <= midpoint < end)
         # - If not, then skip that gene
-        cnx_starts = cnx_rows['start'].values
+        cnx_starts = all_starts[cnx_rows]
         starts_idx = cnx_starts.searchsorted(info_midpoints, 'right')
-        cnx_ends = cnx_rows['end'].values
+        cnx_ends = all_ends[cnx_rows]
         ends_idx = cnx_ends.searchsorted(info_midpoints, 'right')
         ok_genes_mask = (starts_idx == ends_idx + 1)
-        genes_in_cnx_idx = starts_idx.take(ok_genes_mask.nonzero()[0]) - 1
-        gene_log2 = cnx_rows['log2'].values[genes_in_cnx_idx]
-        gene_sizes = (cnx_ends - cnx_starts)[genes_in_cnx_idx]
-        # Stash 'em, including gene name
-        chunk_df = pd.DataFrame({'gene': info_genes[ok_genes_mask],
-                                 'log2': gene_log2,
-                                 'size': gene_sizes})
-        chunks.append(chunk_df)
-
-    df = pd.concat(chunks)
+        genes_in_cnx_idx = starts_idx[ok_genes_mask] - 1
+        codes_chunks.append(info_codes[ok_genes_mask])
+        rows_chunks.append(cnx_rows[genes_in_cnx_idx])
+    print("Keeping", n_kept, "/", n_info,
+          "gene names in gene_info on shared chromosomes")
+
+    codes = np.concatenate(codes_chunks) if codes_chunks else np.array([], int)
+    rows = np.concatenate(rows_chunks) if rows_chunks else np.array([], int)
     # Drop any rows genes with duplicate gene names
-    if not df['gene'].is_unique:
-        dup_idx = df['gene'].duplicated(keep=False)
+    dup_idx = np.bincount(codes, minlength=len(gene_names))[codes] > 1
+    if dup_idx.any():
         print("Found", dup_idx.sum(), "duplicated gene names in",
               fname, file=sys.stderr)
-        df = df[~dup_idx]
-    df = df.set_index('gene').sort_index()
-    return basename(fname), df
+        codes = codes[~dup_idx]
+        rows = rows[~dup_idx]
+    return codes, rows
 
 
 def load_gene_midpoints(gene_resource):
@@ -113,6 +170,163 @@ def load_gene_midpoints(gene_resource):
     return gene_info.assign(midpoint=midpoints)
 
 
+def index_genes(gene_info):
+    """Group gene midpoints by chromosome, for lookup in each sample.
+
+    Genes are numbered by their position in the sorted unique gene names,
+    which is the row order of the collated table.
+
+    Returns: the sorted gene names, and a dict of chromosome -> (midpoints,
+    gene numbers) arrays.
+    """
+    gene_names, codes = np.unique(np.asarray(gene_info['gene'], dtype=str),
+                                  return_inverse=True)
+    chroms = gene_info['chromosome'].values
+    midpoints = gene_info['midpoint'].values
+    chrom_genes = {}
+    for chrom in pd.unique(chroms):
+        idx = (chroms == chrom).nonzero()[0]
+        chrom_genes[chrom] = (midpoints[idx], codes[idx])
+    return gene_names, chrom_genes
+
+
+def _load_job(job, gene_index):
+    fname, min_weight, cache_fname = job
+    if cache_fname:
+        # Take the file's stats before reading it, so a later change is seen
+        stat = os.stat(fname)
+    result = load_cnx(fname, gene_index, min_weight)
+    if cache_fname:
+        write_cached(cache_fname, fname, stat, result)
+    return result
+
+
+def file_digest(path, blocksize=1 << 20):
+    """SHA-1 hex digest of a file's contents."""
+    sha = hashlib.sha1()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(blocksize), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def cache_name(cache_dir, fname, min_weight, gene_digest):
+    """Cache file for one sample's vectors, loaded with these settings."""
+    key = "\t".join([os.path.abspath(fname), str(min_weight), gene_digest])
+    return os.path.join(cache_dir,
+                        hashlib.sha1(key.encode('utf-8')).hexdigest() + ".npz")
+
+
+def read_cached(cache_fname, fname):
+    """Load a sample's cached vectors, if the input file hasn't changed.
+
+    The file's size and mtime are checked first; if those changed, the cached
+    vectors are still used if the contents (SHA-1) are the same.
+
+    Returns: the same tuple as `load_cnx`, or None.
+    """
+    if not os.path.isfile(cache_fname):
+        return None
+    with np.load(cache_fname) as data:
+        cached = {key: data[key] for key in data.files}
+    result = (str(cached['bname']), cached['log2'], cached['sizes'],
+              cached['found'])
+    stat = os.stat(fname)
+    if cached['size'] != stat.st_size or cached['mtime'] != stat.st_mtime:
+        if str(cached['digest']) != file_digest(fname):
+            return None
+        # Touched but not changed; record the new stats
+        write_cached(cache_fname, fname, stat, result)
+    return result
+
+
+def write_cached(cache_fname, fname, stat, result):
+    """Save one sample's vectors with the input file's stats and digest."""
+    bname, log2, sizes, found = result
+    # Write-then-rename so concurrent runs never see a partial file
+    tmp_fname = "%s.%d.tmp.npz" % (cache_fname[:-4], os.getpid())
+    np.savez(tmp_fname, bname=bname, log2=log2, sizes=sizes, found=found,
+             size=stat.st_size, mtime=stat.st_mtime,
+             digest=file_digest(fname))
+    os.rename(tmp_fname, cache_fname)
+
+
+def collate(fnames, gene_resource, min_weight=0, processes=1,
+            cache_dir=None):
+    """Load all samples into genes x samples tables of log2 and sizes.
+
+    With `processes` other than 1, samples are loaded in a pool of worker
+    processes (None = all CPUs), which each receive the gene index once.
+
+    With `cache_dir`, each sample's vectors are saved there, and only the
+    inputs that are new or changed since the last run (or loaded with a
+    different minimum weight or gene resource) are loaded again.
+
+    Returns: DataFrames of log2 ratios and sizes, indexed by gene name, with
+    samples as columns. Genes not found in any sample are dropped.
+    """
+    results = [None] * len(fnames)
+    cache_fnames = [None] * len(fnames)
+    if cache_dir:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        gene_digest = file_digest(gene_resource)
+        genes_fname = os.path.join(cache_dir, "genes-%s.npy" % gene_digest)
+        for i, fname in enumerate(fnames):
+            cache_fnames[i] = cache_name(cache_dir, fname, min_weight,
+                                         gene_digest)
+            results[i] = read_cached(cache_fnames[i], fname)
+    todo = [i for i, result in enumerate(results) if result is None]
+    print("Loading", len(todo), "of", len(fnames), "samples",
+          file=sys.stderr)
+
+    if cache_dir and not todo and os.path.isfile(genes_fname):
+        gene_index = None
+        gene_names = np.load(genes_fname)
+    else:
+        gene_index = index_genes(load_gene_midpoints(gene_resource))
+        gene_names = gene_index[0]
+        if cache_dir:
+            np.save(genes_fname, gene_names)
+
+    jobs = [(fnames[i], min_weight, cache_fnames[i]) for i in todo]
+    loaded = imap_jobs(_load_job, jobs, processes, shared=gene_index)
+    for result, i in zip(loaded, todo):
+        results[i] = result
+
+    all_log2 = np.empty((len(gene_names), len(fnames)), dtype=np.float32)
+    all_sizes = np.empty((len(gene_names), len(fnames)), dtype=np.int32)
+    any_found = np.zeros(len(gene_names), dtype=bool)
+    bnames = []
+    for i, (bname, log2, sizes, found) in enumerate(results):
+        bnames.append(bname)
+        all_log2[:, i] = log2
+        all_sizes[:, i] = sizes
+        any_found |= found
+    print("Loaded", len(bnames), "samples", file=sys.stderr)
+
+    index = pd.Index(gene_names[any_found], name='gene')
+    log2_table = pd.DataFrame(all_log2[any_found], index=index, columns=bnames)
+    sizes = all_sizes[any_found].astype(float)
+    sizes[sizes == 0] = np.nan
+    sizes_table = pd.DataFrame(sizes, index=index, columns=bnames)
+    return log2_table, sizes_table
+
+
+def write_table(table, fname):
+    """Write a genes x samples table as TSV, or as a binary matrix (.npz).
+
+    The .npz file holds the arrays 'gene', 'sample' and 'values'.
+    """
+    if fname.endswith(".npz"):
+        np.savez(fname, gene=np.asarray(table.index, dtype=str),
+                 sample=np.asarray(table.columns, dtype=str),
+                 values=table.values)
+    else:
+        table.to_csv(fname, sep='\t', index=True)
+    print("Wrote", fname, "with", len(table), "rows")
+
+
 if __name__ == '__main__':
     import argparse
     AP = argparse.ArgumentParser(description=__doc__)
@@ -122,26 +336,24 @@ if __name__ == '__main__':
                     help="Ensembl BioMart-derived gene info table.")
     AP.add_argument('-w', '--min-weight', type=int, default=0,
                     help="Minimum segment or bin weight to keep.")
+    AP.add_argument('-p', '--processes', type=int, default=1,
+                    help="""Number of worker processes for loading samples
+                    (0 for all CPUs) [%(default)s].""")
+    AP.add_argument('-c', '--cache', metavar="DIR",
+                    help="""Directory in which to cache each sample's values,
+                    so that only new or changed inputs are loaded again.""")
     AP.add_argument('-o', '--output',
-                    help="Output filename (*.tsv)")
+                    help="Output filename (*.tsv, or *.npz for binary)")
     AP.add_argument('-s', '--sizes',
-                    help="Output filename for containin-segment sizes (*.tsv).")
+                    help="""Output filename for containin-segment sizes (*.tsv
+                    or *.npz).""")
     args = AP.parse_args()
 
-    gene_info = load_gene_midpoints(args.gene_resource)
-
-    bnames, dframes = zip(*[load_cnx(fname, gene_info, args.min_weight)
-                            for fname in args.fnames])
-    print("Loaded", len(bnames), "samples", file=sys.stderr)
+    all_log2, all_sizes = collate(args.fnames, args.gene_resource,
+                                  args.min_weight, args.processes or None,
+                                  args.cache)
 
     # Write log2 values and containing-segment sizes to separate files
-    all_log2 = pd.concat([df['log2'] for df in dframes], axis=1)
-    all_log2.columns = bnames
-    all_log2.to_csv(args.output, sep='\t', index=True)
-    print("Wrote", args.output, "with", len(all_log2), "rows")
-
+    write_table(all_log2, args.output)
     if args.sizes:
-        all_sizes = pd.concat([df['size'] for df in dframes], axis=1)
-        all_sizes.columns = bnames
-        all_sizes.to_csv(args.sizes, sep='\t', index=True)
-        print("Wrote", args.sizes, "with", len(all_sizes), "rows")
+        write_table(all_sizes, args.sizes)
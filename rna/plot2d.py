@@ -15,7 +15,9 @@ Each gene = 1 datapoint --> ~3 million datapoints.
 
 """
 from __future__ import absolute_import, division, print_function
+import os
 import sys
+from functools import reduce
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -24,58 +26,73 @@ import seaborn
 
 from scipy.stats import pearsonr
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+import density2d
+
 seaborn.set(font='Sans', style='whitegrid', context='poster')
 
 
+# Segment size bins, by code in the 'Size' column
+SIZE_LABELS = ['<5MB', '5-50MB', '>50MB']
+
+
 def extract_xy(rna_table, acgh_table):
     """Concatenate paired samples as arrays of per-gene log2 values.
 
-    Returns a 2-column array/DataFrame of all samples' per-gene log2 values,
+    Returns a 2-column DataFrame of all samples' per-gene log2 values,
     concatenating all samples and losing the gene name index. All rows with any
-    NA values are dropped.
+    NA values are dropped. Also returns the Pearson correlation statistics
+    (`RunningCorr`) of those values.
     """
     # Match columns by sample and rows by gene, 1:1
-    rna_table, acgh_table = rna_table.align(acgh_table, join='inner')
+    rna_table, acgh_table = align_indices((rna_table, acgh_table))
     print("Trimmed input tables to shape:", rna_table.shape)
-    # Collect log2 values from paired samples
-    chunks = []
-    for rna_col, acgh_col in zip(rna_table.values.T, acgh_table.values.T):
-        pairs = np.vstack([rna_col, acgh_col])
-        # Drop rows where either value is missing/NaN
-        row_nan = np.isnan(pairs).any(axis=0)
-        pairs = pairs[:, ~row_nan]
-        chunks.append(pairs)
-    allpairs = np.hstack(chunks).T
-    return pd.DataFrame(allpairs, columns=("RNA", "aCGH"))
+    # Sample by sample (column-major), drop cells where either is missing/NaN
+    rna_vals = rna_table.values.T
+    acgh_vals = acgh_table.values.T
+    ok = ~(np.isnan(rna_vals) | np.isnan(acgh_vals))
+    stats = RunningCorr()
+    for acgh_col, rna_col, ok_col in zip(acgh_vals, rna_vals, ok):
+        stats.update(acgh_col[ok_col], rna_col[ok_col])
+    df = pd.DataFrame({'RNA': rna_vals[ok], 'aCGH': acgh_vals[ok]},
+                      columns=('RNA', 'aCGH'))
+    return df, stats
 
 
 def extract_xys(rna_table, acgh_table, size_table):
     """Concatenate paired samples as arrays of per-gene log2 values.
 
-    Returns a 3-column array/DataFrame of all samples' per-gene log2 values,
+    Returns a 3-column DataFrame of all samples' per-gene log2 values,
     concatenating all samples and losing the gene name index. All rows with any
-    NA values are dropped.
+    NA values are dropped. Also returns the Pearson correlation statistics
+    (`RunningCorr`) of the values in each segment size bin, keyed by label.
 
-    Segment sizes are replaced with the labels '<5MB', '5-50MB', '>50MB'.
+    Segment sizes are replaced with the (categorical) labels '<5MB', '5-50MB',
+    '>50MB'.
     """
     tables = rna_table, acgh_table, size_table
     tables = align_indices(tables)
-    print("Trimmed all 3 input tables to shape:", rna_table.shape)
-    # Collect log2 and segment size values from matched samples
-    chunks = []
-    for rna_col, acgh_col, size_col in zip(*[t.values.T for t in tables]):
-        trips = np.vstack([rna_col, acgh_col, size_col])
-        # Drop rows where either value is missing/NaN
-        row_nan = np.isnan(trips).any(axis=0)
-        trips = trips[:, ~row_nan]
-        chunks.append(trips)
-    allpairs = np.hstack(chunks).T
-    df = pd.DataFrame(allpairs, columns=('RNA', 'aCGH', 'Size'))
-    size_labels = np.repeat('5-50MB', len(df))
-    size_labels[df['Size'] < 5e6] = '<5MB'
-    size_labels[df['Size'] > 5e7] = '>50MB'
-    df['Size'] = size_labels
-    return df
+    print("Trimmed all 3 input tables to shape:", tables[0].shape)
+    # Sample by sample (column-major), drop cells where any is missing/NaN
+    rna_vals, acgh_vals, size_vals = [t.values.T for t in tables]
+    ok = ~(np.isnan(rna_vals) | np.isnan(acgh_vals) | np.isnan(size_vals))
+    size_codes = np.ones(size_vals.shape, dtype=np.int8)
+    with np.errstate(invalid='ignore'):
+        size_codes[size_vals < 5e6] = 0
+        size_codes[size_vals > 5e7] = 2
+    stats = {label: RunningCorr() for label in SIZE_LABELS}
+    for acgh_col, rna_col, code_col, ok_col in zip(acgh_vals, rna_vals,
+                                                   size_codes, ok):
+        for code, label in enumerate(SIZE_LABELS):
+            in_bin = ok_col & (code_col == code)
+            stats[label].update(acgh_col[in_bin], rna_col[in_bin])
+    df = pd.DataFrame({
+        'RNA': rna_vals[ok],
+        'aCGH': acgh_vals[ok],
+        'Size': pd.Categorical.from_codes(size_codes[ok], SIZE_LABELS)},
+        columns=('RNA', 'aCGH', 'Size'))
+    return df, stats
 
 
 def align_indices(tables):
@@ -85,17 +102,51 @@ def align_indices(tables):
     """
     common_index = intersect_all([t.index.values for t in tables])
     common_columns = intersect_all([t.columns.values for t in tables])
-    out_tables = [table.loc[common_index, common_columns]
+    out_tables = [table.reindex(index=common_index, columns=common_columns)
                   for table in tables]
     return out_tables
 
 
 def intersect_all(sers):
-    common = sers[0]
-    for other in sers[1:]:
-        common = common[np.isin(common, other)]
-    common.sort()
-    return common
+    """Sorted values common to all of the given arrays."""
+    return reduce(np.intersect1d, sers)
+
+
+class RunningCorr(object):
+    """Pearson correlation of (x, y) pairs, accumulated chunk by chunk.
+
+    Keeps the count, means and sums of squared deviations and of cross
+    products, which are combined with each new chunk's pairwise (Chan et al.)
+    so the result is as accurate as a single pass over all pairs.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean_x = self.mean_y = 0.
+        self.ss_x = self.ss_y = self.sp_xy = 0.
+
+    def update(self, x, y):
+        n_b = len(x)
+        if not n_b:
+            return
+        mean_x_b = x.mean()
+        mean_y_b = y.mean()
+        dx = x - mean_x_b
+        dy = y - mean_y_b
+        n = self.n + n_b
+        delta_x = mean_x_b - self.mean_x
+        delta_y = mean_y_b - self.mean_y
+        factor = self.n * n_b / n
+        self.ss_x += dx.dot(dx) + delta_x ** 2 * factor
+        self.ss_y += dy.dot(dy) + delta_y ** 2 * factor
+        self.sp_xy += dx.dot(dy) + delta_x * delta_y * factor
+        self.mean_x += delta_x * n_b / n
+        self.mean_y += delta_y * n_b / n
+        self.n = n
+
+    @property
+    def r(self):
+        return self.sp_xy / np.sqrt(self.ss_x * self.ss_y)
 
 
 def color_alpha(alpha, core_color=(0.298, 0.447, 0.69)):
@@ -108,19 +159,46 @@ def corr_stats(x, y):
     return r_coef, n
 
 
-def plot_paired_genes(table, output=None):
-    """Hexbin plot of RNA vs. aCGH log2 values."""
+def plot_paired_genes(table, output=None, density=False, stats=None):
+    """Hexbin plot of RNA vs. aCGH log2 values.
+
+    With `density`, draw a pre-binned density image instead of a hexbin.
+
+    Pearson r is taken from `stats` (see `extract_xy`) if given.
+    """
+    if stats is not None:
+        stat_func = lambda _x, _y: (stats.r, stats.n)
+    else:
+        stat_func = corr_stats
     xymin = min(min(table['RNA']), min(table['aCGH']))
     xymax = max(max(table['RNA']), max(table['aCGH']))
     pad = 0.3
     xy_limits = (xymin - pad, xymax + pad)
     nbins = 60
+    if density:
+        dgrid = density2d.DensityGrid.from_points(table['aCGH'], table['RNA'],
+                                                  nbins, xy_limits, xy_limits)
+        _fig, ax_joint, _ax_x, _ax_y = density2d.plot_density(
+            dgrid, space=.03,
+            hist_kws=dict(alpha=None,
+                          color=color_alpha(0.4),
+                          edgecolor=color_alpha(1.0)))
+        r_coef, n = stat_func(table['aCGH'], table['RNA'])
+        ax_joint.text(.03, .97, "Pearson r = {:.3f}\nN = {}".format(r_coef, n),
+                      transform=ax_joint.transAxes, verticalalignment='top')
+        ax_joint.set_xlabel('aCGH')
+        ax_joint.set_ylabel('RNA')
+        ax_joint.plot(xy_limits, xy_limits, color='white', linestyle='-',
+                      linewidth=1, zorder=-1)
+        _save_or_show(output)
+        return
+
     grid = seaborn.jointplot('aCGH', 'RNA', data=table,
                              kind='hex',
                              space=.03,
                              xlim=xy_limits,
                              ylim=xy_limits,
-                             stat_func=corr_stats,
+                             stat_func=stat_func,
                              annot_kws=dict(
                                  template="Pearson r = {val:.3f}\nN = {p}",
                                  # template="N = {p}",
@@ -146,6 +224,10 @@ def plot_paired_genes(table, output=None):
     # Plot a diagonal line
     grid.ax_joint.plot(xy_limits, xy_limits, color='white', linestyle='-',
                        linewidth=1, zorder=-1)
+    _save_or_show(output)
+
+
+def _save_or_show(output):
     if output:
         plt.savefig(output, format='pdf', bbox_inches=0)
         print("Wrote", output, file=sys.stderr)
@@ -153,17 +235,22 @@ def plot_paired_genes(table, output=None):
         plt.show()
 
 
-def plot_paired_genes_facet(table, output=None):
+def plot_paired_genes_facet(table, output=None, density=False, stats=None):
     """Hexbin plot of RNA vs. aCGH log2 values.
 
     Facet by segment size: <5MB<50MB<
+
+    With `density`, draw pre-binned density images instead of hexbins.
+
+    Pearson r and N in each facet are taken from `stats` (see `extract_xys`)
+    if given.
     """
     xymin = min(min(table['RNA']), min(table['aCGH']))
     xymax = max(max(table['RNA']), max(table['aCGH']))
     pad = 0.3
     xy_limits = (xymin - pad, xymax + pad)
     nbins = 50
-    size_labels = ['>50MB', '5-50MB', '<5MB']
+    size_labels = SIZE_LABELS[::-1]
     grid = seaborn.FacetGrid(table, col='Size',
                              col_order=size_labels,
                              xlim=xy_limits, ylim=xy_limits,
@@ -182,16 +269,23 @@ def plot_paired_genes_facet(table, output=None):
         # Use the legend to draw the annotation
         # (adapted from seaborn.axisgrid.JointGrid.annotate)
         data_subset = table[table['Size'] == size_label]
-        pearson_r, _p = corr_stats(data_subset['aCGH'], data_subset['RNA'])
-        N = len(data_subset)
+        if stats is not None:
+            pearson_r, N = stats[size_label].r, stats[size_label].n
+        else:
+            pearson_r, N = corr_stats(data_subset['aCGH'], data_subset['RNA'])
         annotation = "Pearson r = {:.3f}\nN = {}".format(pearson_r, N)
         ax.text(xy_limits[0] + 1, xy_limits[1] - 1, annotation,
                 fontsize='x-small', verticalalignment='top')
         ax.plot(xy_limits, xy_limits, color='lightgray',
                 linestyle='-', linewidth=1, zorder=-1)
-        ax.hexbin(data_subset['aCGH'], data_subset['RNA'],
-                  bins='log', gridsize=nbins, mincnt=1,
-                 )
+        if density:
+            density2d.draw_density(ax, density2d.DensityGrid.from_points(
+                data_subset['aCGH'], data_subset['RNA'], nbins,
+                xy_limits, xy_limits), cmap="viridis")
+        else:
+            ax.hexbin(data_subset['aCGH'], data_subset['RNA'],
+                      bins='log', gridsize=nbins, mincnt=1,
+                     )
         ax.set_xlabel("aCGH")
         ax.set_title(size_label)
     grid.axes.flat[0].set_ylabel("RNA")
@@ -210,6 +304,9 @@ if __name__ == '__main__':
     AP.add_argument('rna', help="CNVkit RNA-based table")
     AP.add_argument('acgh', help="TCGA aCGH-based table")
     AP.add_argument('-s', '--sizes', help="aCGH segment sizes for faceting")
+    AP.add_argument('-d', '--density', action='store_true',
+                    help="""Draw binned density images instead of hexbins;
+                    faster and smaller for millions of points.""")
     AP.add_argument('-o', '--output', help="Output filename (PDF).")
     args = AP.parse_args()
 
@@ -222,9 +319,9 @@ if __name__ == '__main__':
     if args.sizes:
         all_sizes = pd.read_table(args.sizes, index_col=0)
         print("Loaded", all_sizes.shape, "genes x aCGH sample segment sizes")
-        table_xys = extract_xys(all_rna, all_acgh, all_sizes)
-        plot_paired_genes_facet(table_xys, args.output)
+        table_xys, stats = extract_xys(all_rna, all_acgh, all_sizes)
+        plot_paired_genes_facet(table_xys, args.output, args.density, stats)
 
     else:
-        table_xy = extract_xy(all_rna, all_acgh)
-        plot_paired_genes(table_xy, args.output)
+        table_xy, stats = extract_xy(all_rna, all_acgh)
+        plot_paired_genes(table_xy, args.output, args.density, stats)
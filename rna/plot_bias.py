@@ -6,9 +6,11 @@ CNV-RNA bias plot:
 - fit a curve/trendline (e.g. rolling median)
 - calculate % variance explained by the trendline: var(before)- var(after)
 
+The variance explained in each sample is written to a summary table (TSV).
 """
 from __future__ import absolute_import, division, print_function
 import os
+import sys
 
 import numpy as np
 import pandas as pd
@@ -17,14 +19,20 @@ from matplotlib import pyplot as plt
 import cnvlib
 from cnvlib.smoothing import rolling_median
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+import trendline
+
 
 def plot_sample(cnr, key, output_dir):
     """Create a scatter plot of `key` (e.g. GC) vs. log2 ratios.
 
     Point areas are proportional to weight. The rolling median (used as the bias
     correction) is shown as a trendline.
+
+    Returns the log2 variance before and after subtracting the trendline (see
+    `trendline.summarize`).
     """
-    # TODO calculate log2 variance (or weighted SD) before & after
     d = (cnr.data.loc[:, (key, 'log2', 'weight')]
          .sort_values(by=key)
          .reset_index(drop=True))
@@ -38,11 +46,11 @@ def plot_sample(cnr, key, output_dir):
                 color="#606060", edgecolor="none", alpha=.1)
 
     # Show the bias being corrected
-    trendline = rolling_median(d['log2'].values, .1)
-    plt.plot(d[key], trendline,
+    fitted = rolling_median(d['log2'].values, .1)
+    plt.plot(d[key], fitted,
              color='darkorange', linewidth=2, zorder=2)
 
-    print("trend :", np.median(trendline), trendline.var())
+    print("trend :", np.median(fitted), fitted.var())
 
     plt.ylim(-2, 2)
     if key == "gc":
@@ -57,7 +65,7 @@ def plot_sample(cnr, key, output_dir):
     plt.savefig(out_fname, format="png", bbox_inches="tight")
     print("Wrote", out_fname)
     plt.close()
-
+    return trendline.summarize(cnr.sample_id, key, d['log2'].values, fitted)
 
 
 if __name__ == '__main__':
@@ -71,8 +79,16 @@ if __name__ == '__main__':
                     help="Bias correction name.")
     AP.add_argument("-d", "--output-dir",
                     help="Directory to write output files.")
+    AP.add_argument("-s", "--summary",
+                    help="""Output table of the variance explained in each
+                    sample. [Default: <key>_bias.summary.tsv in the output
+                    directory]""")
     args = AP.parse_args()
 
+    summaries = []
     for fname in args.nobias_cnr_fnames:
         cnr = cnvlib.read(fname)
-        plot_sample(cnr, args.key, args.output_dir)
+        summaries.append(plot_sample(cnr, args.key, args.output_dir))
+    summary_fname = args.summary or os.path.join(
+        args.output_dir or '.', "{}_bias.summary.tsv".format(args.key))
+    trendline.write_summary(summaries, summary_fname)
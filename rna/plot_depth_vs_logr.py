@@ -28,8 +28,19 @@ import pandas as pd
 from matplotlib import pyplot as plt
 import seaborn
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+import density2d
+
 AP = argparse.ArgumentParser(description=__doc__)
 AP.add_argument('cnr_files', nargs='+', help="All sample .cnr files.")
+AP.add_argument('-d', '--density', action='store_true',
+                help="""Draw a binned density image instead of a hexbin of
+                every bin.""")
+AP.add_argument('--cache',
+                help="""With --density, save the binned counts to this .npz
+                file and reuse them while it is newer than all inputs and was
+                built from the same input files and bins.""")
 AP.add_argument('-o', '--output', help="Output filename.")
 args = AP.parse_args()
 
@@ -56,40 +67,61 @@ def load_depths_logs(cnr_fnames):
     return pd.DataFrame({'depth': depths, 'log2': logs})
 
 
+LOG2_LIMITS = (-6, 6)
+
+
+def build_density(cnr_fnames, nbins):
+    """Bin all samples' depths and log2 values on a log-scaled depth axis."""
+    d = load_depths_logs(cnr_fnames)
+    return density2d.DensityGrid.from_points(
+        d['depth'], d['log2'], nbins,
+        xlim=(1, d['depth'].max() + 1), ylim=LOG2_LIMITS, xlog=True)
+
 
-d = load_depths_logs(args.cnr_files)
 
-max_x = d['depth'].max() + 1
 nbins = 90
-grid = seaborn.jointplot('depth', 'log2', data=d,
-                         kind='hex',
-                         space=0.03,
-                         xlim=(1, max_x),
-                         ylim=(-6, 6),
-                         stat_func=None,
-                         xscale='log',
-                         joint_kws=dict(
-                             bins='log',
-                             #edgecolors='none',
-                             gridsize=nbins,
-                             mincnt=2,
-                             #xscale='log',
-                         ),
-                         marginal_kws=dict(
-                             bins=None,
-                             hist_kws=dict(
-                                 histtype='stepfilled',
-                                 #alpha=None,
-                                 #color=(0.298, 0.447, 0.69, 0.4),
-                                 #edgecolor=(0.298, 0.447, 0.69, 1.0),
-                                 linewidth=1,
+if args.density:
+    dgrid = density2d.load_or_build(
+        args.cache, args.cnr_files,
+        lambda: build_density(args.cnr_files, nbins),
+        params=(nbins, LOG2_LIMITS, 'log depth'))
+    max_x = dgrid.xedges[-1]
+    _fig, ax_joint, _ax_x, _ax_y = density2d.plot_density(
+        dgrid, mincnt=2, space=0.03, xscale='log')
+else:
+    d = load_depths_logs(args.cnr_files)
+
+    max_x = d['depth'].max() + 1
+    grid = seaborn.jointplot('depth', 'log2', data=d,
+                             kind='hex',
+                             space=0.03,
+                             xlim=(1, max_x),
+                             ylim=(-6, 6),
+                             stat_func=None,
+                             xscale='log',
+                             joint_kws=dict(
+                                 bins='log',
+                                 #edgecolors='none',
+                                 gridsize=nbins,
+                                 mincnt=2,
+                                 #xscale='log',
+                             ),
+                             marginal_kws=dict(
+                                 bins=None,
+                                 hist_kws=dict(
+                                     histtype='stepfilled',
+                                     #alpha=None,
+                                     #color=(0.298, 0.447, 0.69, 0.4),
+                                     #edgecolor=(0.298, 0.447, 0.69, 1.0),
+                                     linewidth=1,
+                                 ),
                              ),
-                         ),
-                        )
+                            )
+    ax_joint = grid.ax_joint
 
-grid.ax_joint.set_xlabel('Observed read depth')
-grid.ax_joint.set_ylabel('Normalized log2 ratio')
-grid.ax_joint.hlines(0, 0, max_x)
+ax_joint.set_xlabel('Observed read depth')
+ax_joint.set_ylabel('Normalized log2 ratio')
+ax_joint.hlines(0, 0, max_x)
 
 
 if args.output:
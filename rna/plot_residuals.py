@@ -11,7 +11,6 @@ Considering:
 
 """
 from __future__ import absolute_import, division, print_function
-from builtins import zip
 import os
 import sys
 
@@ -24,7 +23,11 @@ sn.set(font='Sans', style='whitegrid', context='poster', palette='pastel')
 
 
 def load_tables(acgh_fname, size_fname, rna_fnames):
-    """Load and crunch the input datasets."""
+    """Load and crunch the input datasets.
+
+    The RNA tables are read and reduced to residuals one at a time, so only
+    one of them is in memory at once.
+    """
     acgh_table = pd.read_table(acgh_fname, index_col=0)
     print("Loaded", acgh_table.shape, "genes x aCGH samples")
     if size_fname is not None:
@@ -33,11 +36,11 @@ def load_tables(acgh_fname, size_fname, rna_fnames):
               "genes x aCGH samples's segment sizes")
     else:
         size_table = None
-    rna_tables, rna_labels = zip(*((pd.read_table(fname, index_col=0),
-                                    basename(fname))
-                                   for fname in rna_fnames))
+    rna_tables = ((pd.read_table(fname, index_col=0), basename(fname))
+                  for fname in rna_fnames)
     print("Loading RNA samples incrementally")
-    return extract_residuals(acgh_table, size_table, rna_tables, rna_labels)
+    return extract_residuals(acgh_table, size_table, rna_tables,
+                             len(rna_fnames))
 
 
 def basename(path):
@@ -49,25 +52,40 @@ def basename(path):
     return name
 
 
-def extract_residuals(acgh_table, size_table, rna_tables, rna_labels):
+# Segment size bins, by code in the 'Size' column
+SIZE_LABELS = ['<5MB', '5-50MB', '>50MB']
+
+
+def extract_residuals(acgh_table, size_table, rna_tables, n_tables):
     """Concatenate paired samples as arrays of per-gene log2 values.
 
     Subtract aCGH value from RNA value for each gene.
 
-    Emit 2 columns: differences, and table label (from filename)
+    `rna_tables` is an iterable of `n_tables` pairs of RNA table and table
+    label (from filename), which is consumed one table at a time.
 
-    Returns a 2-column array/DataFrame: RNA estimate residuals, and labels
-    indicated which input table the RNA estimates came from.
+    Returns a DataFrame with the columns: 'Deviation', the absolute RNA
+    estimate residuals (float32); 'Method', the label of the table the RNA
+    estimates came from (categorical); and, if `size_table` is given, 'Size',
+    the aCGH segment size bin (categorical).
 
     Sample and gene name indices are lost here, and all sample-gene cells with
     any NA values (in either RNA or aCGH table) are dropped.
     """
     # ENH? calculate & show signal-to-noise ratio (SNR)
-    dframes = []
-    for rna_table, rna_label in zip(rna_tables, rna_labels):
+    # Each table contributes at most one value per aCGH cell
+    capacity = n_tables * acgh_table.size
+    resids_out = np.empty(capacity, dtype=np.float32)
+    method_codes = np.empty(capacity, dtype=np.int8)
+    if size_table is not None:
+        size_codes = np.empty(capacity, dtype=np.int8)
+    labels = []
+    n_out = 0
+    for rna_table, rna_label in rna_tables:
         print("Processing table", rna_label, "with shape", rna_table.shape)
         # Match columns by sample and rows by gene, 1:1
         acgh_aligned, rna_aligned = acgh_table.align(rna_table, join='inner')
+        del rna_table
         if size_table is not None:
             ra, size_aligned = rna_aligned.align(size_table, join='inner')
             assert (ra.index == rna_aligned.index).all()
@@ -78,20 +96,28 @@ def extract_residuals(acgh_table, size_table, rna_tables, rna_labels):
         resids = acgh_aligned.values.ravel() - rna_aligned.values.ravel()
         # Drop cells where either table is NaN/missing data
         nan_mask = ~np.isnan(resids)
-        resids = np.abs(resids[nan_mask])
-        dframe = pd.DataFrame({'Deviation': resids,
-                               'Method': np.repeat(rna_label, len(resids))})
+        n_ok = nan_mask.sum()
+        chunk = slice(n_out, n_out + n_ok)
+        np.abs(resids[nan_mask], out=resids_out[chunk], casting='same_kind')
+        if rna_label not in labels:
+            labels.append(rna_label)
+        method_codes[chunk] = labels.index(rna_label)
         if size_table is not None:
             # Handle size_aligned
             assert (len(size_aligned.values.ravel()) ==
                     len(acgh_aligned.values.ravel()))
             sizes = size_aligned.values.ravel()[nan_mask]
-            size_labels = np.repeat('5-50MB', len(sizes))
-            size_labels[sizes < 5e6] = '<5MB'
-            size_labels[sizes > 5e7] = '>50MB'
-            dframe['Size'] = size_labels
-        dframes.append(dframe)
-    result = pd.concat(dframes, axis=0)
+            codes = size_codes[chunk]
+            codes[:] = 1
+            codes[sizes < 5e6] = 0
+            codes[sizes > 5e7] = 2
+        n_out += n_ok
+    result = pd.DataFrame({
+        'Deviation': resids_out[:n_out],
+        'Method': pd.Categorical.from_codes(method_codes[:n_out], labels)})
+    if size_table is not None:
+        result['Size'] = pd.Categorical.from_codes(size_codes[:n_out],
+                                                   SIZE_LABELS)
     print("Final table shape:", result.shape)
     return result
 
@@ -100,7 +126,7 @@ def plot_residuals(table, output=None):
     """Violin(?) plot of residuals (y) from TCGA aCGH log2 (x)."""
     if 'Size' in table.columns:
         sn.factorplot(x='Method', y='Deviation', data=table, kind='box',
-                      row='Size', row_order=['>50MB', '5-50MB', '<5MB'],
+                      row='Size', row_order=SIZE_LABELS[::-1],
                       aspect=2.5, showfliers=False)
     else:
         sn.boxplot(x='Method', y='Deviation', data=table, showfliers=False)
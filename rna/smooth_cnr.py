@@ -1,78 +1,134 @@
 #!/usr/bin/env python
-"""Write a copy of the .cnr with smoothed log2 ratios."""
+"""Write a copy of the .cnr with smoothed log2 ratios.
+
+Smoothing method is weighted boxcar by default, or with --method, a weighted
+Kaiser or Hann window (see window_smooth.py) or a window of adaptive width
+(see adaptive_smooth.py); input signal is windsorized at +/- 3. Several window
+sizes can be given at once; each input file is read once and written out
+smoothed at each window size.
+
+With --cohort, the input files must all have the same bins (e.g. the .cnr files
+from one import-rna run), and all samples are smoothed together as a matrix.
+"""
 from __future__ import absolute_import, division, print_function
 import argparse
 import os
 import sys
 
 import numpy as np
-from numpy.lib.stride_tricks import as_strided
 
 import cnvlib
 from cnvlib import smoothing
 from skgenome import tabio
 
+import adaptive_smooth
+import cohort_smooth
+import window_smooth
 
-def get_sliding_window(a, width):
-    """Sliding window over a 2D array.
-
-    Source: https://stackoverflow.com/questions/37447347/dataframe-representation-of-a-rolling-window/41406783#41406783
-    """
-    # NB: a = df.values or np.vstack([x, y]).T
-    assert width >= 0, width
-    s0, s1 = a.strides
-    assert s0 >= 0, s0
-    assert s1 >= 0, s1
-    m, n = a.shape
-    assert n >= 0, n
-    assert m-width+1 >= 0, m-width+1
-    return as_strided(a,
-                      shape=(m-width+1, width, n),
-                      strides=(s0, s0, s1))
+# Output file label for each smoothing method
+METHOD_LABELS = {'boxcar': 'wsmooth', 'kaiser': 'ksmooth', 'hann': 'hsmooth',
+                 'adaptive': 'asmooth'}
 
 
 def rolling_weighted_average(x, w, window_size):
-    """Rolling weighted average with a uniform 'boxcar' window."""
+    """Rolling weighted average with a uniform 'boxcar' window.
+
+    The signal and weights are padded at each end with a mirror image of the
+    `window_size // 2` values nearest that end. Window sums are then taken as
+    differences of cumulative sums, so the cost is O(n) for any window size.
+    Bins with a NaN value or weight are left out of each window's sums; a
+    window with no other bins is NaN.
+    """
     wing = window_size // 2
     window_size = 2 * wing + 1
     xp = np.r_[x[wing-1::-1], x, x[:-wing-1:-1]]
     wp = np.r_[w[wing-1::-1], w, w[:-wing-1:-1]]
-    x_w = np.vstack([xp, wp]).T
-    wins = get_sliding_window(x_w, window_size)
-    result = np.average(wins[:,:,0], axis=1, weights=wins[:,:,1])
-    return result
+    ok = ~(np.isnan(xp) | np.isnan(wp))
+    cum_wx = np.r_[0., np.cumsum(np.where(ok, xp * wp, 0.))]
+    cum_w = np.r_[0., np.cumsum(np.where(ok, wp, 0.))]
+    cum_n = np.r_[0, np.cumsum(ok)]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg = ((cum_wx[window_size:] - cum_wx[:-window_size])
+               / (cum_w[window_size:] - cum_w[:-window_size]))
+    avg[cum_n[window_size:] == cum_n[:-window_size]] = np.nan
+    return avg
 
 
-def clipped_smooth(cnarr, window_size):
-    """Clip signal at +/- 3, then apply polynomial smoothing."""
+def clipped_smooth(cnarr, window_size, method='boxcar'):
+    """Clip signal at +/- 3, then apply weighted smoothing."""
     x = cnarr['log2'].clip(-3, 3).values
     w = cnarr['weight'].values
     wing = smoothing._width2wing(window_size, x)
     assert len(x) == len(w)
-    #  signal = smoothing._pad_array(x, wing)
-    #  weights = smoothing._pad_array(w, wing)
-    return rolling_weighted_average(x, w, 2 * wing + 1)
+    if method == 'boxcar':
+        return rolling_weighted_average(x, w, 2 * wing + 1)
+    if method == 'adaptive':
+        depth = cnarr['depth'].values if 'depth' in cnarr else None
+        return adaptive_smooth.adaptive_weighted_average(x, w, 2 * wing + 1,
+                                                         depth)
+    return window_smooth.weighted_smooth(x, w, wing, method)
 
 
-def smooth_by_arm(cnarr, window):
-    logr_chunks = [clipped_smooth(cnarm, window)
-                   for _chrom, cnarm in cnarr.by_arm()]
-    d = cnarr.data.assign(log2=np.concatenate(logr_chunks))
-    return cnarr.as_dataframe(d)
+def smooth_by_arm(cnarr, windows, method='boxcar'):
+    """Smooth log2 ratios within each chromosome arm.
 
+    Returns a list of copies of `cnarr`, one per window size in `windows`.
+    """
+    arms = [cnarm for _chrom, cnarm in cnarr.by_arm()]
+    smoothed = []
+    for window in windows:
+        logr_chunks = [clipped_smooth(cnarm, window, method)
+                       for cnarm in arms]
+        d = cnarr.data.assign(log2=np.concatenate(logr_chunks))
+        smoothed.append(cnarr.as_dataframe(d))
+    return smoothed
 
-AP = argparse.ArgumentParser(description=__doc__)
-AP.add_argument('cnr_fnames', nargs='+')
-AP.add_argument('-w', '--window', type=int, default=100,
-                help="Window size for smoothing.")
-AP.add_argument('-d', '--output-dir', default='.')
-args = AP.parse_args()
 
-for fname in args.cnr_fnames:
-    cnr = cnvlib.read(fname)
-    cnr = smooth_by_arm(cnr, args.window)
+def write_smoothed(cnr, fname, output_dir, method, window):
     base, ext = os.path.basename(fname).rsplit(".", 1)
-    outfname = "{}/{}.wsmooth{}.{}".format(args.output_dir, base,
-                                           args.window, ext)
+    outfname = "{}/{}.{}{}.{}".format(output_dir.format(window), base,
+                                      METHOD_LABELS[method], window, ext)
     tabio.write(cnr, outfname)
     print("Wrote", outfname, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    AP = argparse.ArgumentParser(description=__doc__)
+    AP.add_argument('cnr_fnames', nargs='+')
+    AP.add_argument('-w', '--window', type=int, nargs='+', default=[100],
+                    help="Window size(s) for smoothing.")
+    AP.add_argument('-m', '--method', choices=sorted(METHOD_LABELS),
+                    default='boxcar',
+                    help="""Window shape. Output files are labeled .wsmoothN
+                    (boxcar), .ksmoothN (kaiser), .hsmoothN (hann) or .asmoothN
+                    (adaptive).
+                    [Default: %(default)s]""")
+    AP.add_argument('-d', '--output-dir', default='.',
+                    help="""Output directory. If it contains '{}', that is
+                    replaced by the window size, e.g. 'wsmooth{}'.""")
+    AP.add_argument('--cohort', action='store_true',
+                    help="""Smooth all samples together. The input files must
+                    have identical bins.""")
+    args = AP.parse_args()
+
+    if args.cohort:
+        cnarrs, log2, weights, bounds = cohort_smooth.load_cohort(
+            args.cnr_fnames)
+        if args.method == 'adaptive' and 'depth' in cnarrs[0]:
+            depths = np.vstack([cnr['depth'].values for cnr in cnarrs])
+        else:
+            depths = None
+        for window in args.window:
+            smoothed = cohort_smooth.clipped_weighted_smooth(
+                log2, weights, bounds, window, args.method, depths)
+            for fname, cnr, logr in zip(args.cnr_fnames, cnarrs, smoothed):
+                write_smoothed(cohort_smooth.with_log2(cnr, logr), fname,
+                               args.output_dir, args.method, window)
+    else:
+        for fname in args.cnr_fnames:
+            cnr = cnvlib.read(fname)
+            for window, cnr_smooth in zip(args.window,
+                                          smooth_by_arm(cnr, args.window,
+                                                        args.method)):
+                write_smoothed(cnr_smooth, fname, args.output_dir,
+                               args.method, window)
@@ -2,6 +2,9 @@
 """Write a copy of the .cnr with smoothed log2 ratios.
 
 Smoothing method is unweighted boxcar, with input signal windsorized at +/- 3.
+
+With --cohort, the input files must all have the same bins (e.g. the .cnr files
+from one import-rna run), and all samples are smoothed together as a matrix.
 """
 from __future__ import absolute_import, division, print_function
 import argparse
@@ -13,6 +16,8 @@ import numpy as np
 import cnvlib
 from skgenome import tabio
 
+import cohort_smooth
+
 
 def clipped_rolling_mean(values, window):
     clipped = values.clip(-3, 3)
@@ -27,18 +32,34 @@ def smooth_by_arm(cnarr, window):
     return cnarr.as_dataframe(d)
 
 
-AP = argparse.ArgumentParser(description=__doc__)
-AP.add_argument('cnr_fnames', nargs='+')
-AP.add_argument('-w', '--window', type=int, default=100,
-                help="Window size for smoothing.")
-AP.add_argument('-d', '--output-dir', default='.')
-args = AP.parse_args()
-
-for fname in args.cnr_fnames:
-    cnr = cnvlib.read(fname)
-    cnr = smooth_by_arm(cnr, args.window)
+def write_smoothed(cnr, fname, output_dir, window):
     base, ext = os.path.basename(fname).rsplit(".", 1)
-    outfname = "{}/{}.tsmooth{}.{}".format(args.output_dir, base,
-                                           args.window, ext)
+    outfname = "{}/{}.tsmooth{}.{}".format(output_dir, base, window, ext)
     tabio.write(cnr, outfname)
     print("Wrote", outfname, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    AP = argparse.ArgumentParser(description=__doc__)
+    AP.add_argument('cnr_fnames', nargs='+')
+    AP.add_argument('-w', '--window', type=int, default=100,
+                    help="Window size for smoothing.")
+    AP.add_argument('-d', '--output-dir', default='.')
+    AP.add_argument('--cohort', action='store_true',
+                    help="""Smooth all samples together. The input files must
+                    have identical bins.""")
+    args = AP.parse_args()
+
+    if args.cohort:
+        cnarrs, log2, _weights, bounds = cohort_smooth.load_cohort(
+            args.cnr_fnames)
+        smoothed = cohort_smooth.clipped_rolling_mean(log2, bounds,
+                                                      args.window)
+        for fname, cnr, logr in zip(args.cnr_fnames, cnarrs, smoothed):
+            write_smoothed(cohort_smooth.with_log2(cnr, logr), fname,
+                           args.output_dir, args.window)
+    else:
+        for fname in args.cnr_fnames:
+            cnr = cnvlib.read(fname)
+            write_smoothed(smooth_by_arm(cnr, args.window), fname,
+                           args.output_dir, args.window)
@@ -2,25 +2,151 @@
 """Convert TCGA SEG-formatted files to CNVkit's .cns format.
 
 Get gene names from the GeneInfo table.
+
+A SEG file with one sample is written as <file basename>.acgh.cns. A SEG file
+with several samples is split by sample ID, and each sample is written as
+<sample ID>.acgh.cns.
 """
 from __future__ import absolute_import, division, print_function
 import argparse
 import os
+import sys
+
+import numpy as np
+import pandas as pd
 
 from cnvlib.rna import load_gene_info
 from skgenome import tabio, GenomicArray as GA
+from skgenome.tabio import seg as seg_format
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+from batch_jobs import imap_jobs
 
 
 def basename(path):
     return os.path.basename(path).split('.', 1)[0]
 
 
-def join_unique(vals):
-    return ','.join(vals.unique())
+def index_genes(gene_info):
+    """Gene coordinates as arrays, for lookup in the segments of each sample.
+
+    Returns: a dict of chromosome name -> chromosome number; then the genes'
+    chromosome numbers, start and end coordinates, and names, in the row
+    order of `gene_info`.
+    """
+    chrom_codes, chroms = pd.factorize(gene_info['chromosome'])
+    return ({chrom: i for i, chrom in enumerate(chroms)},
+            chrom_codes.astype(np.int64),
+            gene_info['start'].values.astype(np.int64),
+            gene_info['end'].values.astype(np.int64),
+            np.asarray(gene_info['gene'].values, dtype=object))
+
+
+def genes_in_segments(segs, gene_index):
+    """List the genes overlapping each segment, in many samples at once.
+
+    `segs` is a DataFrame of the segments of all samples, with an integer
+    'sample' column and the usual 'chromosome', 'start' and 'end'. Within each
+    sample the segments must not overlap, as in SEG files.
+
+    Genes partly overlapping a segment count, as with
+    ``GenomicArray.into_ranges``. Each segment's gene names are unique and in
+    the order of the gene table, joined by commas, or '-' for none.
+
+    Returns: a Series of gene lists, with the index of `segs`.
+    """
+    chrom_ids, g_chrom, g_start, g_end, g_name = gene_index
+    s_chrom = segs['chromosome'].map(chrom_ids)
+    on_gene_chrom = s_chrom.notnull().values
+    s_chrom = s_chrom.values[on_gene_chrom].astype(np.int64)
+    s_sample = segs['sample'].values[on_gene_chrom].astype(np.int64)
+    s_start = segs['start'].values[on_gene_chrom].astype(np.int64)
+    s_end = segs['end'].values[on_gene_chrom].astype(np.int64)
+    s_rows = on_gene_chrom.nonzero()[0]
+
+    # Key each position by (chromosome, sample, coordinate), so one sorted
+    # array holds each sample's segments on each chromosome contiguously
+    n_samples = s_sample.max() + 1 if len(s_sample) else 1
+    span = max(g_end.max(), s_end.max() if len(s_end) else 0) + 1
+    block = s_chrom * n_samples + s_sample
+    order = np.lexsort((s_start, block))
+    key_start = (block * span + s_start)[order]
+    key_end = (block * span + s_end)[order]
 
+    # For each gene in each sample, the sorted segments from the first ending
+    # after the gene's start to the last starting before the gene's end
+    g_block = (g_chrom[:, None] * n_samples + np.arange(n_samples)).ravel()
+    g_idx = np.repeat(np.arange(len(g_name)), n_samples)
+    first = np.searchsorted(key_end, g_block * span + g_start[g_idx], 'right')
+    last = np.searchsorted(key_start, g_block * span + g_end[g_idx], 'left')
+    n_hits = np.maximum(last - first, 0)
+    hit_genes = np.repeat(g_idx, n_hits)
+    hit_segs = (np.repeat(first - np.cumsum(n_hits) + n_hits, n_hits)
+                + np.arange(n_hits.sum()))
 
-def genes_in_segments(segarr, gene_info):
-    return gene_info.into_ranges(segarr, 'gene', '-', join_unique)
+    hits = pd.DataFrame({'seg': s_rows[order[hit_segs]],
+                         'gene_row': hit_genes,
+                         'gene': g_name[hit_genes]})
+    hits = (hits.sort_values(['seg', 'gene_row'], kind='mergesort')
+            .drop_duplicates(['seg', 'gene']))
+    gene_lists = hits.groupby('seg', sort=False)['gene'].agg(','.join)
+    out = np.full(len(segs), '-', dtype=object)
+    out[gene_lists.index.values] = gene_lists.values
+    return pd.Series(out, index=segs.index)
+
+
+def iter_samples(seg_fnames):
+    """Read the samples in each SEG file, in one pass over each file.
+
+    Yields: (output basename, sample ID, DataFrame of segments) per sample.
+    """
+    for seg_fname in seg_fnames:
+        samples = seg_format.parse_seg(seg_fname)
+        first = next(samples, None)
+        if first is None:
+            continue
+        second = next(samples, None)
+        if second is None:
+            sample_id, dframe = first
+            yield basename(seg_fname), sample_id, dframe
+            continue
+        for sample_id, dframe in [first, second]:
+            yield sample_id, sample_id, dframe
+        for sample_id, dframe in samples:
+            yield sample_id, sample_id, dframe
+
+
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _convert_job(job, gene_index):
+    """Assign genes to a batch of samples' segments; write each as .cns."""
+    batch, output_dir = job
+    segs = pd.concat([dframe.assign(sample=i)
+                      for i, (_name, _sid, dframe) in enumerate(batch)],
+                     ignore_index=True)
+    segs['gene'] = genes_in_segments(segs, gene_index)
+    outfnames = []
+    for i, (name, sample_id, _dframe) in enumerate(batch):
+        seg = GA(segs[segs['sample'] == i].drop('sample', axis=1)
+                 .reset_index(drop=True),
+                 {'sample_id': sample_id})
+        # Same row and column order as tabio.read would give
+        seg.sort()
+        seg.sort_columns()
+        outfname = os.path.join(output_dir, name + ".acgh.cns")
+        tabio.write(seg, outfname, 'tab')
+        outfnames.append(outfname)
+    return outfnames
 
 
 if __name__ == '__main__':
@@ -32,20 +158,24 @@ if __name__ == '__main__':
                     help="Ensembl BioMart-derived gene info table.")
     AP.add_argument('-d', '--output-dir', metavar='PATH', default='.',
                     help="Output directory.")
+    AP.add_argument('-p', '--processes', type=int, default=1,
+                    help="""Number of worker processes (0 for all CPUs)
+                    [%(default)s].""")
+    AP.add_argument('-b', '--batch-size', type=int, default=16,
+                    help="""Number of samples to assign genes to together
+                    [%(default)s].""")
 
     args = AP.parse_args()
     gene_info = load_gene_info(args.gene_resource, None, None)
     bad_genes = ['Metazoa_SRP', '5S_rRNA', 'Y_RNA', 'U1', 'U2', 'U3', 'U4',
                  'U5', 'U6', 'U7', 'U8', 'uc_338', 'Clostridiales-1']
     gene_info = gene_info[~gene_info['gene'] .isin(bad_genes)]
-    gene_info = GA(gene_info.loc[:, ('chromosome', 'start', 'end', 'gene')])
+    gene_index = index_genes(gene_info)
 
-    for seg_fname in args.seg_files:
-        seg = tabio.read(seg_fname, 'seg')
-        # Assign gene names to segments using genomic coordinates from gene_info
-        seg['gene'] = genes_in_segments(seg, gene_info)
-
-        outfname = os.path.join(args.output_dir,
-                                basename(seg_fname) + ".acgh.cns")
-        tabio.write(seg, outfname, 'tab')
-        print("Wrote", outfname)
+    jobs = ((batch, args.output_dir)
+            for batch in iter_batches(iter_samples(args.seg_files),
+                                      args.batch_size))
+    for outfnames in imap_jobs(_convert_job, jobs, args.processes,
+                               shared=gene_index):
+        for outfname in outfnames:
+            print("Wrote", outfname)
@@ -0,0 +1,67 @@
+"""Weighted smoothing with an arbitrary window shape, by FFT convolution.
+
+The weighted signal and the weights are each convolved with the window, and
+the first divided by the second. The cost of FFT (or, for windows much
+narrower than the signal, overlap-add) convolution grows only with
+log(window size), so wide windows, up to whole chromosome arms, are cheap.
+
+Arrays may be 1-D (one sample) or 2-D (samples x bins); smoothing is always
+along the last axis.
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+from scipy import signal
+
+# Shape parameter of the Kaiser window, as in cnvlib.smoothing
+KAISER_BETA = 14
+
+WINDOW_SHAPES = ('kaiser', 'hann', 'boxcar')
+
+
+def window_shape(shape, width):
+    """Window of the given shape and (odd) width, scaled to sum to 1."""
+    if shape == 'kaiser':
+        window = np.kaiser(width, KAISER_BETA)
+    elif shape == 'hann':
+        # Drop the zero-valued end points
+        window = np.hanning(width + 2)[1:-1]
+    elif shape == 'boxcar':
+        window = np.ones(width)
+    else:
+        raise ValueError("Unknown window shape: %r" % shape)
+    return window / window.sum()
+
+
+def mirror_pad(a, wing):
+    """Pad the last axis with a mirror image of the `wing` values at each end.
+
+    Same padding as `rolling_weighted_average` in smooth_cnr.py.
+    """
+    return np.concatenate([a[..., wing-1::-1], a, a[..., :-wing-1:-1]],
+                          axis=-1)
+
+
+def weighted_smooth(x, w, wing, shape='kaiser'):
+    """Weighted average of `x` over a window of width ``2 * wing + 1``.
+
+    Bins with a NaN value or weight are left out, since a NaN would otherwise
+    spread through the whole FFT.
+
+    Returns an array of the same shape as `x`.
+    """
+    window = window_shape(shape, 2 * wing + 1)
+    window = window.reshape((1,) * (x.ndim - 1) + (-1,))
+    ok = ~(np.isnan(x) | np.isnan(w))
+    xp = mirror_pad(np.where(ok, x, 0.), wing)
+    wp = mirror_pad(np.where(ok, w, 0.), wing)
+    # Overlap-add is faster unless the window spans much of the signal
+    if hasattr(signal, 'oaconvolve') and window.size * 8 < xp.shape[-1]:
+        convolve = signal.oaconvolve
+    else:
+        convolve = signal.fftconvolve
+    numer = convolve(xp * wp, window, mode='valid', axes=-1)
+    denom = convolve(wp, window, mode='valid', axes=-1)
+    # Round-off can leave tiny nonzero sums where all weights are 0
+    denom[np.abs(denom) < 1e-12] = np.nan
+    return numer / denom
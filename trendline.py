@@ -0,0 +1,40 @@
+"""Summarize how much of each sample's variance a bias trendline explains.
+
+The trendline is the rolling median of coverages or log2 values sorted by a
+bias covariate (e.g. GC content), from `cnvlib.smoothing.rolling_median`. The
+variance of the values before and after subtracting it is written as one row
+per sample of a TSV table.
+
+Used by plot_cnv_bias.py and rna/plot_bias.py; scripts in subdirectories add
+this directory to sys.path to import it.
+"""
+from __future__ import division, print_function
+
+import numpy as np
+import pandas as pd
+
+SUMMARY_COLUMNS = ('sample', 'bias', 'n', 'var_raw', 'var_trend',
+                   'var_resid', 'pct_explained')
+
+
+def summarize(sample_id, bias, values, fitted):
+    """Variance of `values` before and after subtracting the trendline.
+
+    Returns a dict with the keys in `SUMMARY_COLUMNS`.
+    """
+    var_raw = np.var(values)
+    var_resid = np.var(values - fitted)
+    return {'sample': sample_id,
+            'bias': bias,
+            'n': len(values),
+            'var_raw': var_raw,
+            'var_trend': np.var(fitted),
+            'var_resid': var_resid,
+            'pct_explained': 100 * (1 - var_resid / var_raw)}
+
+
+def write_summary(rows, fname):
+    """Write per-sample summaries (from `summarize`) as a TSV table."""
+    table = pd.DataFrame.from_records(list(rows), columns=SUMMARY_COLUMNS)
+    table.to_csv(fname, sep='\t', index=False, float_format='%.6g')
+    print("Wrote", fname, "with", len(table), "samples")